@@ -0,0 +1,48 @@
+"""Gunicorn settings for the Instrument Catalog server.
+
+Usage: gunicorn instrument_catalog:app -c gunicorn.conf.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+
+# Workers must share cached data, such as which instruments have changed and
+# which API keys have been revoked.  Without a configured directory, one is
+# made for this server and its workers (which inherit the environment).
+if not os.environ.get('CACHE_DIR'):
+    os.environ['CACHE_DIR'] = temporary_cache_dir = tempfile.mkdtemp(
+        prefix='instrument-catalog-cache-')
+else:
+    temporary_cache_dir = None
+
+
+def on_exit(server):
+    """Remove the cache directory if it was made for this server."""
+    if temporary_cache_dir is not None:
+        shutil.rmtree(temporary_cache_dir, ignore_errors=True)
+
+
+def pre_fork(server, worker):
+    """Close the master process's database connections before forking.
+
+    This only matters when the app is preloaded (`--preload`).  A forked
+    worker would otherwise share the master's open connections, and two
+    processes using one connection corrupt each other's queries.
+    """
+    package = sys.modules.get('instrument_catalog')
+
+    if package is not None:
+        app = package.app
+
+        for bind in [None] + app.config['DATABASE_REPLICA_BINDS']:
+            package.db.get_engine(app, bind).dispose()
+
+
+def post_worker_init(worker):
+    """Warm up each worker before it accepts its first request."""
+    # The application has already been imported by the worker
+    from instrument_catalog import app, startup
+
+    startup.warm_up(app, connections=worker.cfg.threads)
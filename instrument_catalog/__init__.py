@@ -5,19 +5,40 @@ Instrument Catalog
 A webserver for displaying and editing a catalog of musical instruments.
 """
 import os
-from flask_migrate import Migrate
+import click
 from flask_sslify import SSLify
+from werkzeug.contrib.cache import FileSystemCache
 from werkzeug.contrib.fixers import ProxyFix
 from .server import app
-from .models import db, Category
-from .api import rate_limiter
-from .auth import login_manager
+from .models import db, User, Category, Instrument, category_snapshot
+from .api import RATE_LIMIT_TIERS, rate_limiter
+from .autocomplete import name_snapshot
+from .auth import forget_user, login_manager
+from .cache import StateCache
+from .rendering import render_cache
+from . import auth
+from . import background  # Registers database event listeners
+from . import routing
+from . import search
+from . import startup
 
 
 __all__ = ['app']
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+
+def get_int_env(name):
+    """Return an environment variable as an integer, or None if unset."""
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+# Read replicas of the database, each added as a bind named "replica<n>"
+replica_binds = {'replica{}'.format(index): url for index, url in enumerate(
+    os.environ.get('DATABASE_REPLICA_URLS', '').split())}
+
+
 # For Heroku. See: https://flask-dance.readthedocs.io/en/latest/proxies.html
 app.wsgi_app = ProxyFix(app.wsgi_app)
 
@@ -29,24 +50,131 @@ app.config.update(
         'DATABASE_URL',
         'sqlite:///' + os.path.join(basedir, 'app.db')),
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    SQLALCHEMY_BINDS=replica_binds,
+    DATABASE_REPLICA_BINDS=sorted(replica_binds),
+    # Seconds that clients read from the primary after writing (see README)
+    DATABASE_REPLICA_LAG=get_int_env('DATABASE_REPLICA_LAG') or 10,
+    # Connection pool settings (see README). Unset values keep the defaults.
+    SQLALCHEMY_POOL_SIZE=get_int_env('DATABASE_POOL_SIZE'),
+    SQLALCHEMY_MAX_OVERFLOW=get_int_env('DATABASE_MAX_OVERFLOW'),
+    SQLALCHEMY_POOL_TIMEOUT=get_int_env('DATABASE_POOL_TIMEOUT'),
+    SQLALCHEMY_POOL_RECYCLE=get_int_env('DATABASE_POOL_RECYCLE'),
+    # Replace connections the database closed while they sat in the pool
+    SQLALCHEMY_POOL_PRE_PING=(
+        os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true'),
     SSLIFY_PERMANENT=True,
     GOOGLE_OAUTH_CLIENT_ID=os.environ.get('GOOGLE_CLIENT_ID'),
-    GOOGLE_OAUTH_CLIENT_SECRET=os.environ.get('GOOGLE_CLIENT_SECRET')
+    GOOGLE_OAUTH_CLIENT_SECRET=os.environ.get('GOOGLE_CLIENT_SECRET'),
+    # Save instruments before checking their image URLs (see README)
+    ASYNC_IMAGE_VALIDATION=(
+        os.environ.get('ASYNC_IMAGE_VALIDATION', '').lower() == 'true'),
+    # Part of each HTML page's ETag, so pages change when templates change
+    RELEASE_VERSION=os.environ.get('HEROKU_RELEASE_VERSION', ''),
+    # Limits must be counted in one place shared by every worker process
+    RATELIMIT_STORAGE_URL=os.environ.get('RATELIMIT_STORAGE_URL',
+                                         'memory://'),
+    RATELIMIT_STRATEGY='moving-window',
+    # Send X-RateLimit-* headers so that clients can pace their requests
+    RATELIMIT_HEADERS_ENABLED=True,
+    # Required by the monitoring routes under /internal/ (see README)
+    INTERNAL_TOKEN=os.environ.get('INTERNAL_TOKEN')
 )
 
 db.init_app(app)
-Migrate(app, db)
+
+# The `flask db` commands are only used from the command line, and importing
+# them (and Alembic) takes longer than importing the rest of the app
+if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+    from flask_migrate import Migrate
+    Migrate(app, db)
+
 SSLify(app)  # Redirect http -> https, but only in production
 rate_limiter.init_app(app)
 login_manager.init_app(app)
+db.event.listen(db.session, 'after_flush', routing.note_database_write)
+app.after_request(routing.remember_writes)
+
+# Share cached data between worker processes when a directory is given.
+# Rendered output is kept apart, so that the many items it adds can't crowd
+# out the state which workers rely on.
+if os.environ.get('CACHE_DIR'):
+    render_cache.backend = FileSystemCache(
+        os.path.join(os.environ['CACHE_DIR'], 'rendered'), threshold=20000)
+    shared_state = StateCache(os.path.join(os.environ['CACHE_DIR'], 'state'))
+    category_snapshot.store = shared_state
+    name_snapshot.store = shared_state
+    # Key revocations reach every worker, so principals can be kept longer
+    auth.principal_cache = shared_state
+    routing.recent_writers = shared_state
+
+
+@app.cli.command('seed-database')
+def seed_database():
+    """Add seed data to the database if it's empty."""
+    if startup.seed_database():
+        print('Added seed data.')
+    else:
+        print('The database already has data, so nothing was added.')
+
+
+@app.cli.command('backfill-descriptions')
+def backfill_descriptions():
+    """Store rendered HTML and excerpts for rows which don't have them."""
+    batch_size = 500
+
+    for model in (Category, Instrument):
+        count = 0
+        query = model.query.filter(model.description_excerpt.is_(None))\
+            .order_by(model.id).limit(batch_size)
+
+        # Rendered rows no longer match the query, so each batch is new rows
+        rows = query.all()
+        while rows:
+            for row in rows:
+                row.render_description(row.description)
+
+            db.session.commit()
+            count += len(rows)
+            rows = query.all()
+
+        print('Rendered {count} {table} descriptions.'
+              .format(count=count, table=model.__tablename__))
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Create the full-text search index and fill it with every instrument."""
+    search.create_index(db.session.connection())
+    db.session.commit()
+    print('Rebuilt the search index.')
+
+
+@app.cli.command('check-pending-images')
+def check_pending_images():
+    """Check every image URL which is still waiting to be checked."""
+    # Checks may have been scheduled but never finished, e.g. on a restart
+    pending = db.session.query(Instrument.id, Instrument.image)\
+        .filter(Instrument.image_pending).all()
+
+    for instrument_id, url in pending:
+        background.check_pending_image(app, instrument_id, url)
+
+    print('Checked {count} pending images.'.format(count=len(pending)))
+
+
+@app.cli.command('set-rate-limit-tier')
+@click.argument('user_id', type=int)
+@click.argument('tier', type=click.Choice(sorted(RATE_LIMIT_TIERS)))
+def set_rate_limit_tier(user_id, tier):
+    """Change which API rate limits apply to a user."""
+    user = User.query.get(user_id)
 
+    if user is None:
+        raise click.BadParameter('No user has ID {}.'.format(user_id),
+                                 param_hint='USER_ID')
 
-# Unfortunately, this runs *after* the first request, but before we send a
-# response, thus potentially delaying our response to our first visitor.
-@app.before_first_request
-def initialize_database():
-    """Add seed data to the database if it looks like it's empty."""
-    with app.app_context():
-        if len(Category.query.all()) == 0:
-            from . import db_init
-            db_init.init()
+    user.rate_limit_tier = tier
+    db.session.commit()
+    forget_user(user.id)
+    print('{name} now has {tier} rate limits.'.format(name=user.name,
+                                                      tier=tier))
@@ -4,14 +4,40 @@ instrument_catalog.api
 
 Defines routes for JSON API.
 """
-from flask import (Blueprint, Markup, get_flashed_messages, jsonify, redirect,
-                   render_template, request, url_for)
+import base64
+import binascii
+from datetime import datetime
+from functools import lru_cache
+import gzip
+from itertools import chain
+import json
+import os
+import zlib
+from flask import (Blueprint, Markup, Response, current_app, flash,
+                   get_flashed_messages, jsonify, redirect, render_template,
+                   request, session, stream_with_context, url_for)
 from flask_limiter import Limiter
 from flask_login import current_user, login_required
 import mistune
-import pygments
-from .models import db, User, Category, Instrument, AlternateInstrumentName
-from .validation import get_validated_instrument_data
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+from .auth import create_api_key, revoke_api_key
+from .autocomplete import suggest_instruments
+from .cache import LRUCache
+from .conditional import (conditional_response, has_flashed_messages,
+                          make_etag)
+from . import ratelimit  # Registers the `sqlite://` rate limit storage
+from .models import (db, ApiKey, User, Category, Instrument,
+                     AlternateInstrumentName, category_snapshot,
+                     iter_deleted_instruments, iter_serialized_instruments)
+from .search import search_instruments
+from .validation import (check_image_urls, collapse_spaces,
+                         get_validated_instrument_data)
+
+try:
+    import brotli
+except ImportError:  # Optional: without it, pages are only sent gzipped
+    brotli = None
 
 
 bp = Blueprint('api', __name__)
@@ -19,18 +45,142 @@ bp = Blueprint('api', __name__)
 documentation_bp = Blueprint('documentation', __name__,
                              template_folder='doc')
 
-# TODO If app scales, we'll want to use `moving-window` and redis
-rate_limiter = Limiter(strategy='fixed-window',
-                       storage_uri='memory://',
-                       key_func=lambda: current_user.id)
+# Storage and strategy are configured by `RATELIMIT_*` settings on the app
+rate_limiter = Limiter(key_func=lambda: current_user.id)
 
-rate_limit = rate_limiter.shared_limit('50/minute;2/second', scope='api')
+# Limits for each value of `User.rate_limit_tier`
+RATE_LIMIT_TIERS = {
+    'standard': '50/minute;2/second',
+    'batch': '1000/minute;20/second'
+}
 
 
-def api_jsonify(data, errors=None):
-    """Return a standardized, JSON-ified response."""
+def get_rate_limit():
+    """Return the API rate limits for the authenticated user's tier."""
+    return RATE_LIMIT_TIERS.get(current_user.rate_limit_tier,
+                                RATE_LIMIT_TIERS['standard'])
+
+
+# Conditional requests answered with `304 Not Modified` cost almost nothing,
+# so they aren't counted. This lets clients poll for changes cheaply.
+rate_limit = rate_limiter.shared_limit(
+    get_rate_limit, scope='api',
+    deduct_when=lambda response: response.status_code != 304)
+
+# Clients send a request for each keystroke, and these are cheap to answer
+autocomplete_rate_limit = rate_limiter.shared_limit(
+    '600/minute;10/second', scope='autocomplete')
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_BATCH_SIZE = 1000
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+
+
+def api_jsonify(data, errors=None, links=None):
+    """Return a standardized, JSON-ified response.
+
+    Paginated endpoints also pass `links`, a dict which includes the
+    URL of the `next` page (or None if this is the last page).
+    """
     errors = [] if errors is None else errors
-    return jsonify(successful=not errors, errors=errors, data=data)
+
+    if links is None:
+        return jsonify(successful=not errors, errors=errors, data=data)
+    else:
+        return jsonify(successful=not errors, errors=errors, data=data,
+                       links=links)
+
+
+# Pagination
+
+def encode_cursor(instrument):
+    """Return an opaque cursor marking a position after `instrument`."""
+    position = json.dumps([instrument.name, instrument.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(position).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the (name, id) tuple in a cursor, or None if it's invalid."""
+    try:
+        name, instrument_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        return None
+
+    if not (isinstance(name, str) and isinstance(instrument_id, int)):
+        return None
+
+    return name, instrument_id
+
+
+def paginated_instruments(query):
+    """Return one page of an instrument query as an API response.
+
+    Instruments are sorted by name, then ID. Rather than an offset, the
+    `cursor` query string parameter holds the sort key of the last
+    instrument on the previous page (keyset pagination), so any page is
+    found using an index instead of by counting past earlier rows.
+
+    Args:
+        query (Query): An unordered query for Instrument rows.
+
+    Returns:
+        tuple[Response, int]: A JSON response and HTTP status code.
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        errors = ['`limit` must be an integer.']
+        return api_jsonify({}, errors), 400  # Bad Request
+
+    if limit < 1:
+        errors = ['`limit` must be at least 1.']
+        return api_jsonify({}, errors), 400  # Bad Request
+
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    if 'cursor' in request.args:
+        position = decode_cursor(request.args['cursor'])
+
+        if position is None:
+            errors = ['An invalid `cursor` was provided.']
+            return api_jsonify({}, errors), 400  # Bad Request
+
+        query = query.filter(
+            tuple_(Instrument.name, Instrument.id) > tuple_(*position))
+
+    # Fetch one extra row to find out whether there is another page
+    page = query.order_by(Instrument.name, Instrument.id)\
+        .limit(limit + 1).all()
+
+    if len(page) > limit:
+        page = page[:limit]
+        # Keep other parameters (such as filters) for the next page
+        args = dict(request.args.to_dict(), **request.view_args)
+        args.update(limit=limit, cursor=encode_cursor(page[-1]))
+        next_url = url_for(request.endpoint, _external=True, **args)
+    else:
+        next_url = None
+
+    data = [instrument.serialize() for instrument in page]
+    return api_jsonify(data, links={'next': next_url}), 200  # OK
+
+
+def parse_timestamp(string):
+    """Return a naive UTC datetime for an ISO 8601 string, or None."""
+    string = string.rstrip('Z')  # We only accept UTC, so "Z" is implied
+
+    for timestamp_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                             '%Y-%m-%d'):
+        try:
+            return datetime.strptime(string, timestamp_format)
+        except ValueError:
+            pass
+
+    return None
 
 
 # Event handlers
@@ -75,21 +225,97 @@ class CodeHighlightRenderer(mistune.Renderer):
     def block_code(self, code, lang):
         """Override method to make use of `pygments` in code blocks."""
         if lang:
-            lexer = pygments.lexers.get_lexer_by_name(lang, stripall=True)
-            formatter = pygments.formatters.html.HtmlFormatter()
-            return pygments.highlight(code, lexer, formatter)
+            # Only the API documentation needs pygments, so it's imported
+            # here rather than slowing down every server process's startup
+            from pygments import highlight
+            return highlight(code, get_lexer(lang), get_html_formatter())
         else:
             return '\n<pre><code>{code_block}</code></pre>\n'.format(
                 code_block=mistune.escape(code))
 
 
+@lru_cache(maxsize=None)
+def get_lexer(lang):
+    """Return a (reusable) pygments lexer for a code block's language."""
+    from pygments.lexers import get_lexer_by_name
+    return get_lexer_by_name(lang, stripall=True)
+
+
+@lru_cache(maxsize=None)
+def get_html_formatter():
+    """Return a (reusable) pygments formatter for code blocks."""
+    from pygments.formatters.html import HtmlFormatter
+    return HtmlFormatter()
+
+
 markdown = mistune.Markdown(renderer=CodeHighlightRenderer())
 
 
-@documentation_bp.app_template_filter('doc_markdown')
-def doc_markdown_filter(data, inline=False):
-    """Markdown filter for use in API doc template."""
-    return Markup(markdown(data))
+@documentation_bp.app_template_global()
+@lru_cache(maxsize=None)
+def api_reference():
+    """Return the API reference as HTML, rendering it only once."""
+    path = os.path.join(documentation_bp.root_path, 'doc', 'api.md')
+
+    with open(path, encoding='utf-8') as file:
+        return Markup(markdown(file.read()))
+
+
+# Complete pages for visitors who aren't logged in, each stored with every
+# content encoding we can send.  Keys include the category menu's version.
+documentation_page_cache = LRUCache(maxsize=16)
+
+CONTENT_ENCODINGS = ['br', 'gzip', 'identity']  # In order of preference
+
+
+def compress_page(html):
+    """Return a dict of a page's bytes in each available content encoding.
+
+    Compression is done once per page, so the slowest, smallest settings
+    are used.
+    """
+    data = html.encode('utf-8')
+    variants = {'identity': data, 'gzip': gzip.compress(data, 9)}
+
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, mode=brotli.MODE_TEXT)
+
+    return variants
+
+
+def anonymous_documentation_page():
+    """Return the documentation page as seen before logging in.
+
+    The page is only rendered and compressed when its menu or the server's
+    templates change, not on every request.
+    """
+    # Links on the page include the host name the client used
+    version = make_etag('documentation.api', request.host_url,
+                        category_snapshot.get_version()[0],
+                        current_app.config['RELEASE_VERSION'])
+    variants = documentation_page_cache.get(version)
+
+    if variants is None:
+        variants = compress_page(render_template('api.html', api_keys=[]))
+        documentation_page_cache.set(version, variants)
+
+    encoding = request.accept_encodings.best_match(
+        [encoding for encoding in CONTENT_ENCODINGS if encoding in variants],
+        default='identity')
+
+    def render():
+        response = Response(variants[encoding], mimetype='text/html')
+
+        if encoding != 'identity':
+            response.content_encoding = encoding
+
+        return response
+
+    # Each encoding is a different representation, with its own ETag
+    response = conditional_response(make_etag(version, encoding), None,
+                                    render)
+    response.vary.update(['Accept-Encoding', 'Cookie'])
+    return response
 
 
 # Routes
@@ -97,16 +323,60 @@ def doc_markdown_filter(data, inline=False):
 @documentation_bp.route('/')
 def api():
     """Display API documentation webpage."""
-    return render_template('api.html')
+    if current_user.is_authenticated or has_flashed_messages():
+        return render_template('api.html', api_keys=get_api_keys())
+
+    return anonymous_documentation_page()
+
+
+def get_api_keys():
+    """Return the current user's API keys, if anyone is logged in."""
+    if current_user.is_authenticated:
+        return ApiKey.query.filter_by(user_id=current_user.id)\
+            .order_by(ApiKey.id).all()
+    else:
+        return []
+
+
+@documentation_bp.route('/keys', methods=['POST'])
+@login_required
+def create_key():
+    """Create an API key and display it, which is only possible once."""
+    name = request.form.get('name', '').strip()[:128]
+    api_key, token = create_api_key(current_user.id, name)
+    return render_template('api.html', api_keys=get_api_keys(),
+                           new_api_key=token), 201  # Created
+
+
+@documentation_bp.route('/keys/<int:key_id>/revoke', methods=['POST'])
+@login_required
+def revoke_key(key_id):
+    """Revoke one of the current user's API keys."""
+    api_key = ApiKey.query.get(key_id)
+
+    if api_key is not None and api_key.user_id == current_user.id:
+        prefix = api_key.prefix
+        revoke_api_key(api_key)
+        flash('Your API key {prefix}... has been revoked.'
+              .format(prefix=prefix))
+
+    return redirect(url_for('documentation.api')), 303  # See Other
 
 
 @bp.route('/categories/')
 @rate_limit
 def categories():
     """API endpoint representing all categories."""
-    all_categories = [cat.serialize() for cat in Category.query
-                      .order_by(Category.id)]
-    return api_jsonify(all_categories)
+    # Any change to any category changes the snapshot version
+    token, last_modified = category_snapshot.get_version()
+    etag = make_etag('api.categories', token)
+
+    def render():
+        all_categories = [cat.serialize() for cat in Category.query
+                          .order_by(Category.id)]
+        return api_jsonify(all_categories)
+
+    return conditional_response(etag, last_modified, render)
 
 
 @bp.route('/categories/<int:category_id>/')
@@ -121,12 +391,12 @@ def one_category(category_id):
 @rate_limit
 def one_category_instruments(category_id):
     """API endpoint for instruments in a single category."""
-    category_instruments = [
-        instrument.serialize()
-        for instrument in Category.query.get(category_id).instruments
-    ]
+    if Category.query.get(category_id) is None:
+        errors = ['The requested category id does not exist.']
+        return api_jsonify({}, errors), 404  # Not Found
 
-    return api_jsonify(category_instruments)
+    return paginated_instruments(
+        Instrument.query.filter_by(category_id=category_id))
 
 
 @bp.route('/instruments/', methods=['GET', 'POST'])
@@ -134,9 +404,13 @@ def one_category_instruments(category_id):
 def instruments():
     """API endpoint for creating or listing instruments."""
     if request.method == 'GET':
-        all_instruments = [inst.serialize() for inst in Instrument.query
-                           .order_by(Instrument.name)]
-        return api_jsonify(all_instruments)
+        query = Instrument.query
+
+        if 'name' in request.args:
+            name = collapse_spaces(request.args['name'])
+            query = query.filter(Instrument.named(name))
+
+        return paginated_instruments(query)
 
     elif request.method == 'POST':
         instrument_data, valid = get_validated_instrument_data(request.json)
@@ -145,7 +419,7 @@ def instruments():
             errors = list(get_flashed_messages())
             return api_jsonify(instrument_data, errors), 400  # Bad Request
         else:
-            alternate_names = instrument_data.pop('alternate_names')
+            alternate_names = instrument_data.pop('alternate_names', [])
 
             # Create the requested database entry
             instrument = Instrument(user_id=current_user.id, **instrument_data)
@@ -163,11 +437,213 @@ def instruments():
             return api_jsonify(instrument.serialize()), status_code, headers
 
 
+def is_json_int(value):
+    """Return whether a value decoded from JSON is an integer.
+
+    JSON `true` and `false` are decoded as `bool`, a subclass of `int`, but
+    aren't accepted as IDs.
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def pop_flashed_errors():
+    """Return and clear the messages flashed since this was last called.
+
+    Unlike `get_flashed_messages()`, which only reads flashed messages
+    once per request, this can separate the messages for each validated
+    item in a single request.
+    """
+    return [message for category, message in session.pop('_flashes', [])]
+
+
+@bp.route('/instruments/batch', methods=['POST'])
+@rate_limit
+def batch_instruments():
+    """API endpoint for creating, updating, and deleting many instruments.
+
+    Every operation is validated before any are applied. If all are
+    valid, they are applied together in a single transaction.
+    """
+    operations = request.get_json(silent=True)
+
+    if not isinstance(operations, list) or not operations:
+        errors = ['The request body must be a non-empty array of operations.']
+        return api_jsonify({}, errors), 400  # Bad Request
+    elif len(operations) > MAX_BATCH_SIZE:
+        errors = ['A batch can not contain more than {num} operations.'
+                  .format(num=MAX_BATCH_SIZE)]
+        return api_jsonify({}, errors), 400  # Bad Request
+
+    # Load every instrument being updated or deleted with a few queries
+    targets = Instrument.get_many(
+        operation.get('id') for operation in operations
+        if isinstance(operation, dict) and is_json_int(operation.get('id')))
+
+    # Check image URLs concurrently, so that validation below finds cached
+    # results instead of waiting for each image host one at a time.  With
+    # asynchronous validation, unchecked URLs are checked after saving.
+    if not current_app.config.get('ASYNC_IMAGE_VALIDATION'):
+        check_image_urls(
+            operation['instrument'].get('image') for operation in operations
+            if isinstance(operation, dict)
+            and isinstance(operation.get('instrument'), dict))
+
+    results = []
+    creates = []  # Pairs of (result, Instrument)
+    updates = []  # Tuples of (result, Instrument, validated data)
+    deletes = []  # Pairs of (result, Instrument or None)
+    seen_ids = set()
+
+    for operation in operations:
+        if not isinstance(operation, dict):
+            operation = {}
+
+        action = operation.get('action')
+        instrument_id = operation.get('id')
+        instrument = targets.get(instrument_id)
+        result = {'action': action, 'errors': [], 'data': {}}
+        results.append(result)
+
+        if action not in ('create', 'update', 'delete'):
+            result['errors'].append(
+                '`action` must be "create", "update", or "delete".')
+            continue
+
+        if action in ('update', 'delete'):
+            if not is_json_int(instrument_id):
+                result['errors'].append('`id` must be an instrument id.')
+                continue
+            elif instrument_id in seen_ids:
+                result['errors'].append('Each instrument id can only be'
+                                        ' used once per batch.')
+                continue
+
+            seen_ids.add(instrument_id)
+            result['data'] = {'id': instrument_id}
+
+            # Only the user who created an instrument can modify it
+            if instrument is not None and \
+                    instrument.user_id != current_user.id:
+                result['errors'].append(
+                    'You must authenticate as the user who created'
+                    ' this instrument in order to modify it.')
+                continue
+
+        # Deletes ignore `instrument`, and a missing one is an empty object
+        instrument_input = operation.get('instrument')
+
+        if instrument_input is None:
+            instrument_input = {}
+        elif not isinstance(instrument_input, dict) and action != 'delete':
+            result['errors'].append('`instrument` must be an object.')
+            continue
+
+        if action == 'create':
+            instrument_data, valid = get_validated_instrument_data(
+                instrument_input)
+            result['errors'].extend(pop_flashed_errors())
+            result['data'] = dict(instrument_data)
+
+            if valid:
+                alternate_names = instrument_data.pop('alternate_names', [])
+                instrument = Instrument(user_id=current_user.id,
+                                        **instrument_data)
+                instrument.alternate_names.extend(
+                    AlternateInstrumentName(name=name, index=index)
+                    for index, name in enumerate(alternate_names))
+                creates.append((result, instrument))
+
+        elif action == 'update':
+            if instrument is None:
+                result['errors'].append(
+                    'The requested instrument id does not exist.')
+                continue
+
+            instrument_data, valid = get_validated_instrument_data(
+                instrument_input, existing_instrument=instrument.serialize())
+            result['errors'].extend(pop_flashed_errors())
+            result['data'] = dict(instrument_data, id=instrument_id)
+
+            if valid:
+                updates.append((result, instrument, instrument_data))
+
+        elif action == 'delete':
+            # Like DELETE requests, this succeeds if `instrument` is None
+            deletes.append((result, instrument))
+
+    for result in results:
+        result['successful'] = not result['errors']
+
+    if any(result['errors'] for result in results):
+        errors = ['No changes were made because some operations were'
+                  ' invalid. See the results for each operation.']
+        return api_jsonify(results, errors), 400  # Bad Request
+
+    # === Apply every operation in a single transaction === #
+
+    for result, instrument, instrument_data in updates:
+        new_alt_names = instrument_data.pop('alternate_names', None)
+
+        for key, value in instrument_data.items():
+            setattr(instrument, key, value)
+
+        if new_alt_names is not None:
+            instrument.set_alternate_names(new_alt_names)
+
+    for result, instrument in deletes:
+        if instrument is not None:
+            db.session.delete(instrument)
+
+        result['data'] = {'deleted_instrument_id': result['data']['id']}
+
+    # The session inserts rows for the same table in as few statements as it
+    # can, e.g. every alternate name is written by a single `executemany()`.
+    # New instruments are too, if their IDs can be reserved first.
+    new_ids = Instrument.reserve_ids(len(creates))
+
+    if new_ids is not None:
+        for (result, instrument), instrument_id in zip(creates, new_ids):
+            instrument.id = instrument_id
+
+    db.session.add_all(instrument for result, instrument in creates)
+
+    try:
+        # Serialize after flushing (which assigns new IDs) but before
+        # committing, which would expire every instrument and reload each one
+        db.session.flush()
+
+        for result, instrument in creates:
+            result['data'] = instrument.serialize()
+
+        for result, instrument, instrument_data in updates:
+            result['data'] = instrument.serialize()
+
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        errors = ['No changes were made because they conflicted with'
+                  ' other data in the catalog.']
+        return api_jsonify({}, errors), 409  # Conflict
+
+    return api_jsonify(results), 200  # OK
+
+
 @bp.route('/instruments/<int:instrument_id>/',
           methods=['GET', 'PUT', 'DELETE'])
 @rate_limit
 def one_instrument(instrument_id):
     """API endpoint for retrieving, updating, or deleting instruments."""
+    if request.method == 'GET':
+        last_modified = Instrument.get_updated_at(instrument_id)
+
+        if last_modified is not None:
+            etag = make_etag('api.one_instrument', instrument_id,
+                             last_modified.isoformat())
+            return conditional_response(
+                etag, last_modified,
+                lambda: api_jsonify(Instrument.query.get(instrument_id)
+                                    .serialize()))
+
     instrument = Instrument.query.get(instrument_id)
 
     # We can't return or modify a non-existent instrument, but DELETE is OK
@@ -193,28 +669,14 @@ def one_instrument(instrument_id):
             instrument_data['id'] = instrument_id  # Help with debugging
             return api_jsonify(instrument_data, errors), 400  # Bad Request
         else:
-            new_alt_names = instrument_data.pop('alternate_names')
-            old_alt_names = [alt.name for alt in instrument.alternate_names]
+            # Alternate names are left unchanged if they weren't specified
+            new_alt_names = instrument_data.pop('alternate_names', None)
 
-            for key, value in instrument_data.keys():
+            for key, value in instrument_data.items():
                 setattr(instrument, key, value)
 
-            if new_alternate_names != old_alt_names:
-                # Make sure we don't have more rows than new alternate names
-                del instrument.alternate_names[len(new_alt_names):]
-                # TODO Figure out how to make an atomic commit
-                # We need to commit now, before modifying or adding names, to
-                # avoid failing a UNIQUE constraint in some situations.
-                # Committing early prevents the edit from being atomic.
-                db.session.commit()
-
-                # Update or create new alternate names as needed
-                for index, name in enumerate(new_alt_names):
-                    try:
-                        instrument.alternate_names[index].name = name
-                    except IndexError:
-                        instrument.alternate_names.append(
-                            AlternateInstrumentName(name=name, index=index))
+            if new_alt_names is not None:
+                instrument.set_alternate_names(new_alt_names)
 
             db.session.commit()  # TODO put this in a try...except block?
             return api_jsonify(instrument.serialize()), 200  # OK
@@ -241,12 +703,161 @@ def one_instrument(instrument_id):
 @rate_limit
 def my_instruments():
     """API endpoint for instruments that the authenticated user created."""
-    user_instruments = [
-        instrument.serialize() for instrument in Instrument.query
-        .filter_by(user_id=current_user.id).order_by(Instrument.name)
-    ]
+    return paginated_instruments(
+        Instrument.query.filter_by(user_id=current_user.id))
+
+
+@bp.route('/search')
+@rate_limit
+def search():
+    """API endpoint for finding instruments by words they contain."""
+    query = request.args.get('q', '')
+
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)),
+                    MAX_PAGE_SIZE)
+        page = int(request.args.get('page', 1))
+    except ValueError:
+        errors = ['`limit` and `page` must be integers.']
+        return api_jsonify({}, errors), 400  # Bad Request
+
+    if limit < 1 or page < 1:
+        errors = ['`limit` and `page` must be at least 1.']
+        return api_jsonify({}, errors), 400  # Bad Request
+
+    # Fetch one extra result to find out whether there is another page
+    results = search_instruments(query, limit + 1, (page - 1) * limit)
+
+    if len(results) > limit:
+        results = results[:limit]
+        next_url = url_for('api.search', q=query, limit=limit, page=page + 1,
+                           _external=True)
+    else:
+        next_url = None
+
+    data = [instrument.serialize() for instrument in results]
+    return api_jsonify(data, links={'next': next_url}), 200  # OK
 
-    return api_jsonify(user_instruments)
+
+@bp.route('/autocomplete')
+@autocomplete_rate_limit
+def autocomplete():
+    """API endpoint for instrument names beginning with some characters."""
+    prefix = request.args.get('prefix', '')
+
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_SUGGESTIONS)),
+                    MAX_SUGGESTIONS)
+    except ValueError:
+        return api_jsonify({}, ['`limit` must be an integer.']), 400
+
+    if limit < 1:
+        return api_jsonify({}, ['`limit` must be at least 1.']), 400
+
+    return api_jsonify(suggest_instruments(prefix, limit)), 200  # OK
+
+
+# API keys
+
+@bp.route('/keys/', methods=['GET', 'POST'])
+@rate_limit
+def api_keys():
+    """API endpoint for the authenticated user's API keys."""
+    if request.method == 'GET':
+        keys = get_api_keys()
+        return api_jsonify([key.serialize() for key in keys]), 200  # OK
+
+    elif request.method == 'POST':
+        name = (request.get_json(silent=True) or {}).get('name', '')
+
+        if not isinstance(name, str) or len(name) > 128:
+            errors = ['`name` must be a string of at most 128 characters.']
+            return api_jsonify({}, errors), 400  # Bad Request
+
+        api_key, token = create_api_key(current_user.id, name.strip())
+        data = dict(api_key.serialize(), key=token)
+        return api_jsonify(data), 201  # Created
+
+
+@bp.route('/keys/<int:key_id>/', methods=['DELETE'])
+@rate_limit
+def one_api_key(key_id):
+    """API endpoint for revoking one of the authenticated user's API keys."""
+    api_key = ApiKey.query.get(key_id)
+
+    # DELETE requests are idempotent, so we return a successful response
+    # even if the key doesn't exist (or belongs to someone else)
+    if api_key is not None and api_key.user_id == current_user.id:
+        revoke_api_key(api_key)
+
+    return api_jsonify({'deleted_api_key_id': key_id}), 200  # OK
+
+
+# Bulk export
+
+def iter_ndjson_chunks(updated_since=None, lines_per_chunk=500):
+    """Yield byte strings of newline-delimited JSON, one instrument per line.
+
+    If `updated_since` is given, instruments deleted since then follow the
+    changed ones, each as a line marked `"deleted": true`.  Lines are
+    grouped into chunks so that each write to the client carries a
+    reasonable amount of data.
+    """
+    instruments = iter_serialized_instruments(updated_since)
+
+    if updated_since is not None:
+        instruments = chain(instruments,
+                            iter_deleted_instruments(updated_since))
+
+    lines = []
+
+    for instrument in instruments:
+        lines.append(json.dumps(instrument, separators=(',', ':')))
+
+        if len(lines) >= lines_per_chunk:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def iter_gzip_chunks(chunks):
+    """Yield gzip-compressed data for an iterable of byte strings."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip header
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+@bp.route('/export.ndjson', defaults={'compressed': False})
+@bp.route('/export.ndjson.gz', defaults={'compressed': True})
+@rate_limit
+def export(compressed):
+    """API endpoint streaming every instrument as newline-delimited JSON."""
+    if 'updated_since' in request.args:
+        updated_since = parse_timestamp(request.args['updated_since'])
+
+        if updated_since is None:
+            errors = ['`updated_since` must be an ISO 8601 UTC timestamp.']
+            return api_jsonify({}, errors), 400  # Bad Request
+    else:
+        updated_since = None
+
+    # Rows are read from the database while the response is being sent
+    chunks = iter_ndjson_chunks(updated_since)
+
+    if compressed:
+        return Response(stream_with_context(iter_gzip_chunks(chunks)),
+                        mimetype='application/gzip')
+    else:
+        return Response(stream_with_context(chunks),
+                        mimetype='application/x-ndjson')
 
 
 # NOTE This route must be the last one defined so it doesn't override others
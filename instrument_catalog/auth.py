@@ -10,7 +10,9 @@ from flask_dance.consumer import oauth_authorized, oauth_error
 from flask_dance.contrib.google import make_google_blueprint, google
 from flask_login import (LoginManager, current_user, login_required,
                          login_user, logout_user)
-from .models import db, User
+from werkzeug.contrib.cache import SimpleCache
+from .background import record_api_key_use
+from .models import db, ApiKey, User
 
 
 bp = Blueprint('auth', __name__)
@@ -26,12 +28,96 @@ login_manager.refresh_view
 login_manager.session_protection = 'strong'
 
 
+# Principals for logged-in users (keyed by user ID) and verified API keys
+# (keyed by the key's hash). Most requests then need no query to find out who
+# is making them. Revoking a key here can't remove it from other processes'
+# caches, so principals are only kept for a few seconds unless this is
+# replaced by a shared cache.
+principal_cache = SimpleCache(threshold=4096, default_timeout=5)
+
+
+class UserPrincipal(object):
+    """The parts of a user needed to handle most requests.
+
+    Principals are small enough to be cached in place of `User` objects,
+    and have the attributes which flask-login requires of a user.  The few
+    handlers which need anything else can call `load_user()`.
+    """
+    __slots__ = ('id', 'rate_limit_tier', 'api_key_id')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, rate_limit_tier, api_key_id=None):
+        self.id = id
+        self.rate_limit_tier = rate_limit_tier
+        self.api_key_id = api_key_id
+
+    def get_id(self):
+        """Return a Unicode representation of the user ID."""
+        return str(self.id)
+
+    def load_user(self):
+        """Return the full `User` row for this principal."""
+        return User.query.get(self.id)
+
+
+def forget_api_key(token_hash):
+    """Remove an API key from the cache, e.g. after it has been revoked."""
+    principal_cache.delete('api-key:' + token_hash)
+
+
+def forget_user(user_id):
+    """Remove every cached principal for a user, e.g. after it changes."""
+    principal_cache.delete('user:{}'.format(user_id))
+
+    for token_hash, in db.session.query(ApiKey.token_hash)\
+            .filter_by(user_id=user_id):
+        forget_api_key(token_hash)
+
+
+def create_api_key(user_id, name=''):
+    """Save a new API key for a user.
+
+    Returns:
+        tuple[ApiKey, str]: The saved key and its token, which is the only
+                            time the token is available.
+    """
+    api_key, token = ApiKey.generate(user_id, name)
+    db.session.add(api_key)
+    db.session.commit()
+    return api_key, token
+
+
+def revoke_api_key(api_key):
+    """Delete an API key, so that it no longer authenticates anyone."""
+    token_hash = api_key.token_hash
+    db.session.delete(api_key)
+    db.session.commit()
+    forget_api_key(token_hash)
+
+
 # flask-login functions
 
 @login_manager.user_loader
 def load_user_from_cookie(user_id):
     """Return a user object (or None) from a Unicode user ID."""
-    return User.query.get(int(user_id))
+    principal = principal_cache.get('user:' + user_id)
+
+    if principal is None:
+        # Cached principals must reflect changes such as new rate limits
+        with db.session().using_primary():
+            row = db.session.query(User.id, User.rate_limit_tier)\
+                .filter_by(id=int(user_id)).one_or_none()
+
+        if row is None:
+            return None
+
+        principal = UserPrincipal(*row)
+        principal_cache.set('user:' + user_id, principal)
+
+    return principal
 
 
 @login_manager.request_loader
@@ -40,11 +126,26 @@ def load_user_from_header(request):
     auth_header = request.headers.get('Authorization')
 
     if auth_header and auth_header.startswith('Bearer '):
-        api_key = auth_header[len('Bearer '):]
-        user_id = User.verify_api_key(api_key)
+        token_hash = ApiKey.hash_token(auth_header[len('Bearer '):])
+        principal = principal_cache.get('api-key:' + token_hash)
+
+        if principal is None:
+            # Unknown keys aren't cached, so they can't crowd out real ones.
+            # Replicas may not have seen a key's creation or revocation yet.
+            with db.session().using_primary():
+                row = db.session.query(User.id, User.rate_limit_tier,
+                                       ApiKey.id)\
+                    .join(ApiKey.user)\
+                    .filter(ApiKey.token_hash == token_hash).one_or_none()
 
-        if user_id is not None:
-            return User.query.get(user_id)
+            if row is None:
+                return None
+
+            principal = UserPrincipal(*row)
+            principal_cache.set('api-key:' + token_hash, principal)
+
+        record_api_key_use(principal.api_key_id)
+        return principal
 
     return None
 
@@ -77,10 +178,12 @@ def login_completed(blueprint, token):
         user_data = google.get('/oauth2/v2/userinfo').json()
         # => locale, given_name, link, id, name, family_name, picture, gender
 
-        user = User.query.filter_by(
-            oauth_provider=blueprint.name,
-            provider_user_id=user_data.get('id')
-        ).one_or_none()
+        # This GET request writes, so it must find users on the primary
+        with db.session().using_primary():
+            user = User.query.filter_by(
+                oauth_provider=blueprint.name,
+                provider_user_id=user_data.get('id')
+            ).one_or_none()
 
         if user is None:
             user = User(name=user_data.get('given_name'),
@@ -123,16 +226,19 @@ def login():
 @login_required
 def logout():
     """Log the user out and redirect to the home page."""
+    user = current_user.load_user()
+
     # Revoke our access to the user's Google account
     oauth_logout = google.post(
         'https://accounts.google.com/o/oauth2/revoke',
-        params={'token': current_user.access_token},
+        params={'token': user.access_token},
         headers={'Content-Type': 'application/x-www-form-urlencoded'})
 
     # Remove the user's OAuth access token from our database
-    current_user.access_token = None
-    db.session.add(current_user)
+    user.access_token = None
+    db.session.add(user)
     db.session.commit()
+    forget_user(user.id)
 
     # Log out the user in our server environment
     logout_user()
@@ -0,0 +1,203 @@
+"""
+instrument_catalog.autocomplete
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Suggests instrument names which begin with a few typed characters.
+
+Every instrument name and alternate name is kept in memory in a sorted
+list, so finding the names with a given prefix is a binary search rather
+than a database query.  The list is loaded on first use.  Every process
+then updates its list in place with the instruments changed by any
+process, which are recorded in the snapshot's shared store.
+"""
+from bisect import bisect_left, insort
+from threading import Lock
+from .cache import IncrementalSnapshot
+from .models import (db, Instrument, AlternateInstrumentName,
+                     changed_instrument_ids, reads_primary)
+
+
+def normalize(name):
+    """Return the form of a name used for matching prefixes."""
+    return ' '.join(name.casefold().split())
+
+
+class PrefixIndex(object):
+    """Instrument names sorted for fast prefix lookups.
+
+    Each name is stored under a key made of its normalized form followed
+    by its instrument's ID, so that every key is unique and keys sharing a
+    prefix are next to each other.
+
+    Args:
+        names (dict): Lists of names keyed by instrument ID, where the first
+                      name in each list is the instrument's primary name.
+    """
+    __slots__ = ('_entries', '_names', '_lock')
+
+    def __init__(self, names):
+        self._names = names
+        self._entries = sorted(
+            self._make_entry(name, instrument_id)
+            for instrument_id, instrument_names in names.items()
+            for name in instrument_names)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _make_entry(name, instrument_id):
+        # '\0' sorts before every other character, so "harp" comes before
+        # "harp guitar" no matter what the instruments' IDs are
+        return (normalize(name) + '\0' + str(instrument_id), name,
+                instrument_id)
+
+    def update(self, instrument_id, names):
+        """Replace the names stored for an instrument.
+
+        Args:
+            instrument_id (int): The instrument's ID.
+            names (list[str]): The instrument's primary name followed by
+                               its alternate names, or an empty list if
+                               the instrument has been deleted.
+        """
+        with self._lock:
+            entries = self._entries
+
+            for name in self._names.pop(instrument_id, []):
+                entry = self._make_entry(name, instrument_id)
+                index = bisect_left(entries, entry)
+
+                if index < len(entries) and entries[index] == entry:
+                    del entries[index]
+
+            if names:
+                self._names[instrument_id] = names
+
+                for name in names:
+                    insort(entries, self._make_entry(name, instrument_id))
+
+    def suggest(self, prefix, limit):
+        """Return instruments with a name beginning with `prefix`.
+
+        Each instrument is suggested at most once, under whichever of its
+        names comes first alphabetically.
+
+        Args:
+            prefix (str): The beginning of a name, in any letter case.
+            limit (int): The maximum number of suggestions to return.
+
+        Returns:
+            list[dict]: Suggestions in alphabetical order.
+        """
+        prefix = normalize(prefix)
+        suggestions = []
+        seen = set()
+
+        if not prefix:
+            return suggestions
+
+        with self._lock:
+            index = bisect_left(self._entries, (prefix,))
+
+            while len(suggestions) < limit and index < len(self._entries):
+                key, name, instrument_id = self._entries[index]
+                index += 1
+
+                if not key.startswith(prefix):
+                    break
+
+                if instrument_id in seen:
+                    continue
+
+                seen.add(instrument_id)
+                suggestions.append({
+                    'id': instrument_id,
+                    'name': name,
+                    'instrument_name': self._names[instrument_id][0]
+                })
+
+        return suggestions
+
+
+@reads_primary
+def load_instrument_names(instrument_ids=None):
+    """Query the names of instruments.
+
+    Args:
+        instrument_ids (iterable[int]): Which instruments to load.  By
+                                        default, every instrument is loaded.
+
+    Returns:
+        dict: Lists of names keyed by instrument ID, each list starting
+              with the instrument's primary name.
+    """
+    instruments = db.session.query(Instrument.id, Instrument.name)
+    alternates = db.session.query(AlternateInstrumentName.instrument_id,
+                                  AlternateInstrumentName.name)
+
+    if instrument_ids is not None:
+        instrument_ids = list(instrument_ids)
+        instruments = instruments.filter(Instrument.id.in_(instrument_ids))
+        alternates = alternates.filter(
+            AlternateInstrumentName.instrument_id.in_(instrument_ids))
+
+    names = {instrument_id: [name] for instrument_id, name in instruments}
+
+    for instrument_id, name in alternates:
+        if instrument_id in names:
+            names[instrument_id].append(name)
+
+    return names
+
+
+def update_names(index, instrument_ids):
+    """Reload the names of some instruments in a `PrefixIndex`."""
+    names = load_instrument_names(instrument_ids)
+
+    for instrument_id in instrument_ids:
+        index.update(instrument_id, names.get(instrument_id, []))
+
+
+# Reloaded in full every hour, in case a process stopped between committing
+# a change and recording it
+name_snapshot = IncrementalSnapshot(
+    'instrument-names', lambda: PrefixIndex(load_instrument_names()),
+    update_names, max_age=60 * 60)
+
+
+def suggest_instruments(prefix, limit):
+    """Return instruments with a name beginning with `prefix`.
+
+    See `PrefixIndex.suggest` for details.
+    """
+    return name_snapshot.get().suggest(prefix, limit)
+
+
+# Keeping the index current
+
+@db.event.listens_for(db.session, 'after_flush')
+def note_name_changes(session, flush_context):
+    """Remember which instruments may have new names."""
+    session.info.setdefault('autocomplete_changes', set())\
+        .update(changed_instrument_ids(session))
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def update_name_index(session):
+    """Tell every process which instruments' names may have changed.
+
+    Each process reloads those instruments' names on its next lookup,
+    when it's safe to query.
+    """
+    changed = session.info.pop('autocomplete_changes', None)
+
+    if changed:
+        name_snapshot.record(changed)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_name_changes(session):
+    """Forget changes which were never committed."""
+    session.info.pop('autocomplete_changes', None)
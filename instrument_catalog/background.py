@@ -0,0 +1,148 @@
+"""
+instrument_catalog.background
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Runs slow work, such as checking image URLs, outside of HTTP requests.
+"""
+import atexit
+from datetime import datetime
+import logging
+from threading import Lock, Timer
+from flask import current_app
+from sqlalchemy import bindparam
+from .models import db, ApiKey, Instrument
+from .validation import check_image_url, image_url_executor
+
+
+# Any object with the `concurrent.futures.Executor.submit()` interface can be
+# used here instead, such as a process pool or a client for a local queue.
+executor = image_url_executor
+
+logger = logging.getLogger(__name__)
+
+
+def submit(function, *args):
+    """Run a function with `executor`, logging any exception it raises."""
+    executor.submit(function, *args).add_done_callback(log_failure)
+
+
+def log_failure(future):
+    """Log the exception of a finished background task, if it raised one."""
+    error = future.exception()
+
+    if error is not None:
+        logger.error('Background task failed', exc_info=error)
+
+
+def check_pending_image(app, instrument_id, url):
+    """Check an instrument's pending image URL and save the result.
+
+    Valid URLs are kept (after following any redirects) and invalid ones
+    are removed. Nothing is changed if the instrument's image has been
+    edited since the check was scheduled.
+    """
+    _, error = result = check_image_url(url)
+
+    with app.app_context():
+        instrument = Instrument.query.get(instrument_id)
+
+        if (instrument is not None and instrument.image_pending
+                and instrument.image == url):
+            instrument.image = None if error else result[0]
+            instrument.image_pending = False
+            db.session.commit()
+
+
+def schedule_image_check(instrument_id, url):
+    """Check an instrument's pending image in the background."""
+    app = current_app._get_current_object()  # Not just a context-local proxy
+    submit(check_pending_image, app, instrument_id, url)
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def note_pending_images(session, flush_context):
+    """Remember instruments whose images need checking after commit."""
+    pending = session.info.setdefault('pending_images', {})
+
+    for obj in session.new.union(session.dirty):
+        if isinstance(obj, Instrument) and obj.image_pending:
+            # Committing expires every instance, so save what we need now
+            pending[obj.id] = obj.image
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def check_pending_images(session):
+    """Start background checks of images which were just committed."""
+    for instrument_id, url in session.info.pop('pending_images', {}).items():
+        schedule_image_check(instrument_id, url)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_pending_images(session):
+    """Forget images from changes which were never committed."""
+    session.info.pop('pending_images', None)
+
+
+# API key usage
+
+# Seconds between writes of API keys' last-used times
+API_KEY_USE_INTERVAL = 60
+
+# The latest use of each API key which hasn't been written yet
+api_key_uses = {}
+api_key_uses_lock = Lock()
+api_key_uses_timer = None  # Set while a write is waiting to start
+api_key_uses_app = None
+
+
+def write_api_key_uses(app):
+    """Save the last-used times of API keys with a single statement."""
+    global api_key_uses_timer
+
+    with api_key_uses_lock:
+        uses = [{'key_id': api_key_id, 'used_at': used_at}
+                for api_key_id, used_at in api_key_uses.items()]
+        api_key_uses.clear()
+        api_key_uses_timer = None
+
+    if uses:
+        with app.app_context():
+            db.session.execute(
+                ApiKey.__table__.update()
+                .where(ApiKey.id == bindparam('key_id'))
+                .values(last_used_at=bindparam('used_at')),
+                uses)
+            db.session.commit()
+
+
+def record_api_key_use(api_key_id):
+    """Note that an API key was used, writing recent uses in batches.
+
+    Writing each use as it happened would add a database write to every
+    API request.  Instead, the first use after a write starts a timer, and
+    every use until it fires is saved together `API_KEY_USE_INTERVAL`
+    seconds later.  Uses which are still waiting when the process exits
+    are saved then.
+    """
+    global api_key_uses_timer, api_key_uses_app
+    app = current_app._get_current_object()
+
+    with api_key_uses_lock:
+        api_key_uses[api_key_id] = datetime.utcnow()
+        api_key_uses_app = app
+
+        if api_key_uses_timer is None:
+            api_key_uses_timer = Timer(API_KEY_USE_INTERVAL, submit,
+                                       (write_api_key_uses, app))
+            api_key_uses_timer.daemon = True  # Exiting doesn't wait for it
+            api_key_uses_timer.start()
+
+
+@atexit.register
+def write_remaining_api_key_uses():
+    """Save the uses which are still waiting when the process exits."""
+    if api_key_uses_app is not None:
+        try:
+            write_api_key_uses(api_key_uses_app)
+        except Exception:
+            logger.exception('Saving API key uses failed')
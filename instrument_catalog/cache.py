@@ -0,0 +1,377 @@
+"""
+instrument_catalog.cache
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Defines small caches used to avoid repeating expensive work.
+"""
+from collections import OrderedDict
+from datetime import datetime
+import os
+import pickle
+import tempfile
+from threading import Lock
+import time
+from uuid import uuid4
+from werkzeug.contrib.cache import FileSystemCache, SimpleCache
+
+
+class LRUCache(object):
+    """A bounded mapping which discards its least recently used items.
+
+    The cache keeps hit, miss, and eviction counters so that its
+    effectiveness can be checked in a running server.  An optional
+    shared `backend` (any `werkzeug.contrib.cache.BaseCache` instance)
+    is consulted on a local miss, which lets every worker process
+    reuse values computed by the others.
+
+    Args:
+        maxsize (int): The maximum number of items held in-process.
+        backend (BaseCache): An optional cache shared between processes.
+        timeout (int): Seconds that values are kept in `backend`, where
+                       0 means that they never expire.
+    """
+    def __init__(self, maxsize=1024, backend=None, timeout=0):
+        self.maxsize = maxsize
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Return the value cached for `key` or None."""
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            except KeyError:
+                pass
+
+        value = self.backend.get(key) if self.backend is not None else None
+
+        if value is None:
+            with self._lock:
+                self.misses += 1
+        else:
+            with self._lock:
+                self.hits += 1
+            self._store(key, value)
+
+        return value
+
+    def set(self, key, value):
+        """Cache `value` for `key`, in-process and in the shared backend."""
+        self._store(key, value)
+
+        if self.backend is not None:
+            self.backend.set(key, value, timeout=self.timeout)
+
+    def clear(self):
+        """Remove every in-process item and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return a dict of the cache's counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize
+        }
+
+    def _store(self, key, value):
+        """Add an item in-process, evicting the oldest one if needed."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+
+class StateCache(FileSystemCache):
+    """A file system cache which only discards items once they've expired.
+
+    Once a `FileSystemCache` holds more than `threshold` items, it deletes
+    every third file whatever it holds.  That suits output which can be
+    rendered again, but not state which other processes rely on, such as
+    snapshot versions or the clients which wrote recently.  This cache only
+    removes expired items instead, at most once per `prune_interval`
+    seconds, and otherwise grows past `threshold`.
+
+    Its `add()` is also atomic between processes, so it can hand out
+    numbers or other claims which no two processes may share.
+
+    Args:
+        cache_dir (str): A directory used by nothing but this cache.
+        threshold (int): How many items the cache holds before it looks
+                         for expired ones.
+        default_timeout (int): Seconds that items are kept by default.
+        prune_interval (int): Minimum seconds between looking for expired
+                              items, since that reads every file.
+    """
+    def __init__(self, cache_dir, threshold=20000, default_timeout=300,
+                 prune_interval=60):
+        self.prune_interval = prune_interval
+        self._next_prune = 0
+        super().__init__(cache_dir, threshold, default_timeout)
+
+    def _prune(self):
+        if self._threshold == 0 or not self._file_count > self._threshold \
+                or time.time() < self._next_prune:
+            return
+
+        now = time.time()
+        self._next_prune = now + self.prune_interval
+
+        for filename in self._list_dir():
+            try:
+                with open(filename, 'rb') as f:
+                    expires = pickle.load(f)
+
+                if expires != 0 and expires <= now:
+                    os.remove(filename)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                pass  # Another process removed or is replacing it
+
+        self._update_count(value=len(self._list_dir()))
+
+    def add(self, key, value, timeout=None):
+        """Store an item only if `key` is unused, returning whether it was.
+
+        `FileSystemCache.add()` checks for the key's file and then writes
+        it, so two processes can both add the same key.  Here, the item is
+        written to a temporary file which is then linked to the key's file
+        name, which fails if that file already exists.
+        """
+        self._prune()
+        filename = self._get_filename(key)
+
+        try:
+            fd, tmp = tempfile.mkstemp(suffix=self._fs_transaction_suffix,
+                                       dir=self._path)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(self._normalize_timeout(timeout), f, 1)
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmp, self._mode)
+        except (IOError, OSError):
+            return False
+
+        try:
+            try:
+                os.link(tmp, filename)
+            except FileExistsError:
+                # An expired item counts as unused, and reading removes it
+                if self.get(key) is not None:
+                    return False
+
+                os.link(tmp, filename)
+        except (IOError, OSError):
+            return False
+        finally:
+            os.remove(tmp)
+
+        self._update_count(delta=1)
+        return True
+
+
+class VersionedSnapshot(object):
+    """A value loaded once and reused until any process invalidates it.
+
+    Each snapshot has a version token kept in `store`.  Reading the
+    snapshot only compares that token with the one seen at load time,
+    which is much cheaper than loading the value again.  When `store` is
+    shared between processes (such as a `FileSystemCache`), invalidating
+    the snapshot in one worker makes every worker reload it.
+
+    Args:
+        name (str): A name for the snapshot, unique within `store`.
+        loader (callable): A function returning the snapshot's value.
+        store (BaseCache): Where version tokens are kept.  Defaults to a
+                           cache private to the current process.
+    """
+    def __init__(self, name, loader, store=None):
+        self.key = 'snapshot-version:' + name
+        self.loader = loader
+        self.store = store if store is not None else SimpleCache()
+        self._version = None
+        self._value = None
+
+    def get(self):
+        """Return the snapshot's value, reloading it if it is outdated."""
+        # Read the version *before* loading, so that a write which happens
+        # while we're loading is noticed on the next call
+        version = self.get_version()
+
+        if version != self._version:
+            self._value = self.loader()
+            self._version = version
+
+        return self._value
+
+    def get_version(self):
+        """Return the current version without loading the value.
+
+        Returns:
+            tuple[str, datetime]: A unique token and the (UTC) time at
+                                  which the snapshot was invalidated.
+        """
+        version = self.store.get(self.key)
+
+        if version is None:
+            # Nothing has been stored yet, or the store has discarded it
+            version = self.invalidate()
+
+        return version
+
+    def invalidate(self):
+        """Mark the snapshot as outdated in every process sharing `store`."""
+        version = (uuid4().hex, datetime.utcnow())
+        self._store_version(version)
+        return version
+
+    def _store_version(self, version):
+        self.store.set(self.key, version, timeout=0)
+
+
+class IncrementalSnapshot(VersionedSnapshot):
+    """A snapshot which processes update in place instead of reloading.
+
+    After changing the data behind some of the value, a process calls
+    `record()` with the keys it changed.  Each record is numbered and kept
+    in `store`, and every process passes the keys recorded since it last
+    looked to `updater`, which updates its copy of the value.  Calling
+    `invalidate()` still makes every process reload the whole value.
+
+    A process reloads the whole value when records it needs have expired
+    from `store`, or after `max_age` seconds.  Records are numbered with
+    the store's `add()`, which must be atomic between the processes sharing
+    `store` so that no two records claim the same number.  `StateCache`'s
+    is, but `FileSystemCache`'s isn't.  Within a process, records are
+    numbered one at a time.
+
+    Args:
+        name (str): A name for the snapshot, unique within `store`.
+        loader (callable): A function returning the snapshot's value.
+        updater (callable): Called with the value and a set of changed
+                            keys, which it updates in place.
+        store (BaseCache): Where version tokens and records are kept.
+                           Defaults to a cache private to the current
+                           process.
+        log_timeout (int): Seconds that records are kept in `store`.
+        max_age (int): Seconds after which a value is reloaded anyway, or
+                       None to keep it until it's invalidated.
+    """
+    def __init__(self, name, loader, updater, store=None,
+                 log_timeout=60 * 60, max_age=None):
+        super().__init__(name, loader, store)
+        self.updater = updater
+        self.log_timeout = log_timeout
+        self.max_age = max_age
+        self.name = name
+        self._position = 0
+        self._loaded_at = 0
+        self._lock = Lock()
+        self._record_lock = Lock()
+
+    def get(self):
+        """Return the snapshot's value, applying any recorded changes."""
+        with self._lock:
+            version = self.get_version()
+
+            if version != self._version or (
+                    self.max_age is not None and
+                    time.monotonic() - self._loaded_at > self.max_age):
+                return self._reload(version)
+
+            changes = set()
+            position = self._position
+
+            while True:
+                record = self.store.get(self._record_key(version,
+                                                         position + 1))
+                if record is None:
+                    break
+
+                changes.update(record)
+                position += 1
+
+            head = self._get_head(version)
+
+            # Records this process hasn't applied have expired
+            if head is None or head > position:
+                return self._reload(self.get_version())
+
+            if changes:
+                self.updater(self._value, changes)
+
+            self._position = position
+            return self._value
+
+    def record(self, keys):
+        """Tell every process sharing `store` that some keys have changed.
+
+        Args:
+            keys (iterable): Keys which `updater` will be called with.
+        """
+        with self._record_lock:
+            version = self.get_version()
+            head = self._get_head(version)
+
+            if head is None:
+                return  # Every process will reload the value instead
+
+            number = head + 1
+
+            while not self.store.add(self._record_key(version, number),
+                                     list(keys), timeout=self.log_timeout):
+                number += 1
+
+            # Another process may have already moved the head further, but
+            # moving it back only means readers check for records less
+            # strictly
+            self.store.set(self._head_key(version), number, timeout=0)
+
+    def _reload(self, version):
+        """Load the value again and apply only records made after that."""
+        # Read the head *before* loading, like the version in `get()`
+        self._position = self._get_head(version) or 0
+        self._value = self.loader()
+        self._version = version
+        self._loaded_at = time.monotonic()
+        return self._value
+
+    def _store_version(self, version):
+        # Numbering starts before any process can see the new version
+        self.store.set(self._head_key(version), 0, timeout=0)
+        super()._store_version(version)
+
+    def _get_head(self, version):
+        """Return the number of the latest record, or None if it's lost.
+
+        A lost head means records can't be numbered or checked, so the
+        snapshot is invalidated, which makes every process reload it.
+        """
+        head = self.store.get(self._head_key(version))
+
+        if head is None and version == self.store.get(self.key):
+            self.invalidate()
+
+        return head
+
+    def _head_key(self, version):
+        return 'snapshot-head:{}:{}'.format(self.name, version[0])
+
+    def _record_key(self, version, number):
+        return 'snapshot-record:{}:{}:{}'.format(self.name, version[0],
+                                                 number)
@@ -0,0 +1,81 @@
+"""
+instrument_catalog.conditional
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Supports conditional GET requests using ETags and modification times.
+"""
+import hashlib
+from flask import current_app, make_response, request, session
+
+
+def make_etag(*parts):
+    """Return a strong ETag value built from every part given."""
+    data = '\0'.join(str(part) for part in parts).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def has_flashed_messages():
+    """Return whether a page would show messages which were flashed.
+
+    Each message is only shown once, so such a page must be rendered for
+    this request, not answered from a cache or with `304 Not Modified`.
+    """
+    return bool(session.get('_flashes'))
+
+
+def request_is_fresh(etag, last_modified=None):
+    """Return whether the client's cached copy of a resource is current.
+
+    Args:
+        etag (str): The resource's current ETag.
+        last_modified (datetime): When the resource last changed (UTC).
+
+    Returns:
+        bool: True if the client sent a matching `If-None-Match` header
+              or, lacking that, an `If-Modified-Since` header no older
+              than `last_modified`.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates have no fractional seconds
+        return last_modified.replace(microsecond=0) <= \
+            request.if_modified_since.replace(tzinfo=None)
+
+    return False
+
+
+def conditional_response(etag, last_modified, render, private=False):
+    """Return a response, or a `304 Not Modified` if the client is current.
+
+    Calling `render` (and whatever database work it needs) is skipped
+    entirely when the client already has the current representation.
+
+    Args:
+        etag (str): The resource's current ETag.
+        last_modified (datetime): When the resource last changed, or None.
+        render (callable): Returns a view function style return value.
+        private (bool): Whether the response differs between users, so
+                        shared caches must not store it.
+
+    Returns:
+        Response: The rendered or empty response, with validators set.
+    """
+    if request_is_fresh(etag, last_modified):
+        response = current_app.response_class(status=304)  # Not Modified
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag)
+
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+    # Clients may keep a copy, but must check that it's current before use
+    response.cache_control.no_cache = True
+
+    if private:
+        response.cache_control.private = True
+
+    return response
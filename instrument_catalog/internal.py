@@ -0,0 +1,40 @@
+"""
+instrument_catalog.internal
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Defines routes for monitoring a running server, hidden from the public.
+
+Each request is answered by a single worker process, so the numbers
+describe that process only.  Requests must send the token from the
+`INTERNAL_TOKEN` setting as `Authorization: Bearer <token>`; without a
+configured token, these routes don't exist.
+"""
+import hmac
+import os
+from flask import Blueprint, abort, current_app, jsonify, request
+from .models import db
+from .pool import get_pool_status
+from .rendering import render_cache
+
+
+bp = Blueprint('internal', __name__)
+
+
+@bp.before_request
+def check_token():
+    """Respond as if the route doesn't exist, unless the token matches."""
+    token = current_app.config.get('INTERNAL_TOKEN')
+    scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+
+    if not token or scheme.lower() != 'bearer' or \
+            not hmac.compare_digest(given.encode(), token.encode()):
+        abort(404)  # Not Found
+
+
+@bp.route('/pool')
+def pool():
+    """Report this process's database connection pool usage."""
+    replicas = {bind: get_pool_status(db.get_engine(current_app, bind))
+                for bind in current_app.config['DATABASE_REPLICA_BINDS']}
+    return jsonify(pid=os.getpid(), pool=get_pool_status(db.engine),
+                   replicas=replicas, render_cache=render_cache.stats())
@@ -4,29 +4,24 @@ instrument_catalog.models
 
 Defines classes for interfacing with the app's database.
 """
-from flask import current_app
-from flask_sqlalchemy import SQLAlchemy
-from itsdangerous import URLSafeSerializer, BadData
+import base64
+from collections import namedtuple
+from datetime import datetime
+from functools import wraps
+import hashlib
+from itertools import chain, groupby, islice
+from operator import attrgetter, itemgetter
+import os
+from flask import Markup
+from .cache import VersionedSnapshot
+from .pool import SQLAlchemy
+from .rendering import excerpt, render_markdown
 
 
 db = SQLAlchemy()
-serializer = None  # Will hold an instance of URLSafeSerializer
 
-
-def get_serializer():
-    """Return an instance of URLSafeSerializer."""
-    global serializer
-
-    # We need access to our app's secret key to create the serializer, but we
-    # don't have access to `current_app` in global scope (we're not in an app
-    # context), so we'll instantiate the serializer inside this function, which
-    # can be called once we *are* in an app context. We'll cache the serializer
-    # in global scope so that we don't create a new instance on each call.
-    serializer = serializer or URLSafeSerializer(
-            secret_key=current_app.secret_key,
-            signer_kwargs={'key_derivation': 'hmac'})
-
-    return serializer
+# IDs in one `IN (...)` list, below the 999 variables older SQLite builds allow
+MAX_IDS_PER_QUERY = 500
 
 
 class User(db.Model):
@@ -42,6 +37,9 @@ class User(db.Model):
     oauth_provider = db.Column(db.String(128))
     provider_user_id = db.Column(db.String)
     access_token = db.Column(db.String)
+    # Names a set of API rate limits in `api.RATE_LIMIT_TIERS`
+    rate_limit_tier = db.Column(db.String(32), nullable=False,
+                                default='standard', server_default='standard')
 
     # Properties and methods used by flask-login
 
@@ -53,28 +51,94 @@ class User(db.Model):
         """Return a Unicode representation of the user ID."""
         return str(self.id)
 
-    # Methods related to API keys
 
-    def get_api_key(self):
-        """Return an API key (a signed user ID)."""
-        # TODO Improve this naive implementation by generating random API keys
-        # and storing them in encrypted form. Also allow for invalidating keys
-        # and generating new ones.
-        serializer = get_serializer()
-        return serializer.dumps(self.id)
+class ApiKey(db.Model):
+    """Class representing a key for authenticating API requests.
+
+    Only a hash of each key is stored.  Keys are long random strings, so a
+    fast hash protects them as well as a slow one would, and a key can be
+    found with a single indexed lookup.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False,
+                        index=True)
+    name = db.Column(db.String(128), nullable=False, default='')
+    # The start of the key, so that users can tell their keys apart
+    prefix = db.Column(db.String(8), nullable=False)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+    # Written in batches, so it may be a minute or so behind
+    last_used_at = db.Column(db.DateTime)
+
+    user = db.relationship(
+        'User', backref=db.backref('api_keys', order_by='ApiKey.id',
+                                   cascade='all, delete-orphan'))
 
     @staticmethod
-    def verify_api_key(api_key):
-        """Return `api_key`'s associated user ID or None."""
-        serializer = get_serializer()
+    def hash_token(token):
+        """Return the hash stored for a key."""
+        return hashlib.sha256(token.encode()).hexdigest()
 
-        try:
-            return int(serializer.loads(api_key))
-        except (BadData, ValueError):
-            return None
+    @classmethod
+    def generate(cls, user_id, name=''):
+        """Create a new key for a user.
 
+        Returns:
+            tuple[ApiKey, str]: The key (not yet added to the session) and
+                                its token, which can't be recovered later.
+        """
+        token = base64.urlsafe_b64encode(os.urandom(32))\
+            .rstrip(b'=').decode()
+        api_key = cls(user_id=user_id, name=name, prefix=token[:8],
+                      token_hash=cls.hash_token(token))
+        return api_key, token
 
-class Category(db.Model):
+    def serialize(self):
+        """Return a dict of the key's information, without the key itself."""
+        last_used = self.last_used_at
+
+        return {
+            'id': self.id,
+            'name': self.name,
+            'prefix': self.prefix,
+            'created_at': self.created_at.isoformat() + 'Z',
+            'last_used_at': last_used.isoformat() + 'Z' if last_used else None
+        }
+
+
+class RenderedDescriptionMixin(object):
+    """Mixin for models with a markdown `description` column.
+
+    Rendered HTML and a plain text excerpt of the description are stored
+    alongside it, so pages can display them without rendering markdown.
+    Both are updated automatically whenever `description` is assigned.
+    """
+
+    description_html = db.Column(db.Text)
+    description_excerpt = db.Column(db.String(255))
+
+    def render_description(self, description):
+        """Update the stored HTML and excerpt from a markdown string."""
+        self.description_html = render_markdown(description)
+        self.description_excerpt = excerpt(self.description_html)
+
+    def get_description_html(self):
+        """Return the description as sanitized HTML."""
+        if self.description_html is None:  # Row has not been backfilled
+            self.render_description(self.description)
+
+        return Markup(self.description_html)
+
+    def get_description_excerpt(self):
+        """Return the start of the description as plain text."""
+        if self.description_excerpt is None:  # Row has not been backfilled
+            self.render_description(self.description)
+
+        return self.description_excerpt
+
+
+class Category(RenderedDescriptionMixin, db.Model):
     """Class representing an instrument category."""
 
     id = db.Column(db.Integer, primary_key=True)
@@ -101,20 +165,34 @@ class AlternateInstrumentName(db.Model):
 
     instrument_id = db.Column(db.Integer,
                               db.ForeignKey('instrument.id'), primary_key=True)
-    name = db.Column(db.String(128), primary_key=True)
+    # Indexed on its own for looking up instruments by any of their names
+    name = db.Column(db.String(128), primary_key=True, index=True)
     index = db.Column(db.SmallInteger)  # Used for display ordering
 
 
-class Instrument(db.Model):
+class Instrument(RenderedDescriptionMixin, db.Model):
     """Class representing an alternate name for a given instrument."""
 
+    __table_args__ = (
+        # Instruments are listed by name, then ID, usually within a single
+        # category or user, so these indexes return rows already sorted
+        db.Index('ix_instrument_category_id_name',
+                 'category_id', 'name', 'id'),
+        db.Index('ix_instrument_user_id_name', 'user_id', 'name', 'id'),
+        db.Index('ix_instrument_name', 'name', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), nullable=False)
     description = db.Column(db.String(16384), nullable=False)
     image = db.Column(db.String(512))
+    # True while `image` waits to be checked in the background
+    image_pending = db.Column(db.Boolean, nullable=False, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'),
                             nullable=False)
+    # Kept current by `touch_updated_instruments()`, even for alternate names
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     user = db.relationship('User', lazy=True)
 
@@ -122,14 +200,144 @@ class Instrument(db.Model):
                                backref=db.backref('instruments', lazy=True,
                                                   order_by='Instrument.name'))
 
-    alternate_names = db.relationship('AlternateInstrumentName', lazy=False,
+    # Loaded by a second query for every instrument loaded together, rather
+    # than joined, which would repeat each instrument's row once per name
+    alternate_names = db.relationship('AlternateInstrumentName',
+                                      lazy='selectin',
                                       order_by='AlternateInstrumentName.index',
                                       cascade='all, delete-orphan')
 
     def get_image_url(self):
         """Return the instrument's image URL or a fallback placeholder."""
+        if self.image_pending:  # Don't display an image until it's checked
+            return '/static/logo.svg'
+
         return self.image or '/static/logo.svg'
 
+    def set_alternate_names(self, names):
+        """Replace the instrument's alternate names with a list of strings.
+
+        Only rows which actually change are written.  A name which replaces
+        a removed name at the same position is an UPDATE of that row, and
+        names which keep their position aren't written at all.
+
+        Changes are flushed in two steps so that no statement conflicts on
+        the `unique_instrument_index` constraint.  First, removed rows are
+        deleted and every row which moves leaves its position: straight to
+        its new position if no row holds it yet, otherwise to a temporary
+        (negative) index.  Then rows at temporary indexes and new rows take
+        the positions which are now free.
+
+        The session is flushed but not committed, so this can be one part
+        of a larger transaction.
+        """
+        alternates = list(self.alternate_names)
+
+        if names == [alt.name for alt in alternates]:
+            return
+
+        positions = {name: index for index, name in enumerate(names)}
+        existing = {alt.name for alt in alternates}
+        occupied = {alt.index for alt in alternates}
+        added = {positions[name]: name for name in names
+                 if name not in existing}
+        removed = []
+
+        for alt in alternates:
+            if alt.name in positions:
+                continue
+            elif alt.index in added:
+                # Rename in place, since the new name has the same position
+                alt.name = added.pop(alt.index)
+            else:
+                removed.append(alt)
+
+        moved = [alt for alt in alternates
+                 if alt not in removed and alt.index != positions[alt.name]]
+        blocked = [alt for alt in moved if positions[alt.name] in occupied]
+
+        for alt in removed:
+            self.alternate_names.remove(alt)  # Deleted as an orphan
+
+        for alt in moved:
+            if alt in blocked:
+                alt.index = -1 - positions[alt.name]
+            else:
+                alt.index = positions[alt.name]
+
+        if (removed or moved) and (blocked or added):
+            db.session.flush()
+
+        for alt in blocked:
+            alt.index = positions[alt.name]
+
+        self.alternate_names.extend(
+            AlternateInstrumentName(name=name, index=index)
+            for index, name in added.items())
+
+        # Keep the loaded list in display order, as it would be when queried
+        self.alternate_names.sort(key=attrgetter('index'))
+
+    @classmethod
+    def named(cls, name):
+        """Return a filter for instruments with a primary or alternate name.
+
+        Both lookups use an index, however many alternate names there are.
+        """
+        alias_matches = db.session.query(
+            AlternateInstrumentName.instrument_id
+        ).filter(
+            AlternateInstrumentName.name == name
+        )
+        return db.or_(cls.name == name, cls.id.in_(alias_matches))
+
+    @classmethod
+    def get_many(cls, instrument_ids):
+        """Return a dict of the instruments with the given IDs, keyed by ID.
+
+        IDs are queried in batches of `MAX_IDS_PER_QUERY`, so any number
+        can be given.  Missing instruments are left out.
+        """
+        instrument_ids = list(instrument_ids)
+        instruments = {}
+
+        for start in range(0, len(instrument_ids), MAX_IDS_PER_QUERY):
+            batch = instrument_ids[start:start + MAX_IDS_PER_QUERY]
+            instruments.update((instrument.id, instrument) for instrument
+                               in cls.query.filter(cls.id.in_(batch)))
+
+        return instruments
+
+    @classmethod
+    def reserve_ids(cls, count):
+        """Return IDs for new instruments, or None if they can't be reserved.
+
+        The session inserts instruments which already have IDs with a single
+        `executemany()`, rather than one INSERT each to find out each new
+        ID.  PostgreSQL reserves IDs from the table's sequence with one
+        query.  SQLite has no sequence, and as it has no network round trip
+        per statement, its IDs are still assigned while inserting.
+        """
+        dialect = db.session.get_bind(cls.__mapper__).dialect
+
+        if count == 0 or dialect.name != 'postgresql':
+            return None
+
+        rows = db.session.execute(
+            "SELECT nextval(pg_get_serial_sequence('instrument', 'id'))"
+            ' FROM generate_series(1, :count)', {'count': count})
+        return [instrument_id for instrument_id, in rows]
+
+    @classmethod
+    def get_updated_at(cls, instrument_id):
+        """Return when an instrument last changed, or None if it's missing.
+
+        Only one column is read, which is enough to answer a conditional
+        request without loading the full row.
+        """
+        return db.session.query(cls.updated_at)\
+            .filter_by(id=instrument_id).scalar()
+
     def serialize(self):
         """Return a dict of the instrument's information.
 
@@ -142,6 +350,308 @@ class Instrument(db.Model):
             'name': self.name,
             'description': self.description,
             'image': self.image,
+            'image_pending': self.image_pending,
             'category_id': self.category_id,
             'alternate_names': [alt.name for alt in self.alternate_names]
         }
+
+
+class DeletedInstrument(db.Model):
+    """Class recording when an instrument was deleted.
+
+    Exports of recent changes list these, so that clients keeping a copy
+    of the catalog can remove deleted instruments from it.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    deleted_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow, index=True)
+
+
+@db.event.listens_for(Category.description, 'set')
+@db.event.listens_for(Instrument.description, 'set')
+def description_changed(target, value, oldvalue, initiator):
+    """Re-render the stored HTML and excerpt for a new description."""
+    # This is called before the new value is assigned to `target.description`
+    target.render_description(value)
+
+
+# Data kept after the request that read it
+
+def reads_primary(function):
+    """Decorate a function to run its queries on the primary database.
+
+    Use this for loaders of snapshots and other data kept until the next
+    change, which must never come from a replica that is behind.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with db.session().using_primary():
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+# Category snapshot shared by every request
+
+CategorySummary = namedtuple('CategorySummary',
+                             ['id', 'name', 'description_html'])
+
+
+@reads_primary
+def load_category_summaries():
+    """Return a list of read-only copies of every category's data.
+
+    Unlike model instances, these are not tied to a database session, so
+    they can safely be reused by later requests.
+    """
+    return [CategorySummary(cat.id, cat.name, cat.get_description_html())
+            for cat in Category.query.order_by(Category.id)]
+
+
+category_snapshot = VersionedSnapshot('categories', load_category_summaries)
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def note_category_changes(session, flush_context):
+    """Remember whether this transaction has written any categories."""
+    changed = chain(session.new, session.dirty, session.deleted)
+
+    if any(isinstance(obj, Category) for obj in changed):
+        session.info['categories_changed'] = True
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_category_snapshot(session):
+    """Make every process reload categories after they're committed."""
+    if session.info.pop('categories_changed', False):
+        category_snapshot.invalidate()
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_category_changes(session):
+    """Forget category writes which were never committed."""
+    session.info.pop('categories_changed', None)
+
+
+# Streamed listing of every instrument
+
+def iter_with_alternate_names(rows, get_id):
+    """Pair each instrument row with a list of its alternate names.
+
+    Alternate names are read by one query per batch of rows instead of
+    being joined, so each instrument stays a single row no matter how many
+    names it has.
+
+    Args:
+        rows (iterable): Rows which each describe one instrument.
+        get_id (callable): Returns the instrument ID of a row.
+
+    Yields:
+        tuple: A row and its instrument's alternate names, in order.
+    """
+    rows = iter(rows)
+
+    while True:
+        batch = list(islice(rows, MAX_IDS_PER_QUERY))
+
+        if not batch:
+            return
+
+        names = {}
+        alternates = db.session.query(
+            AlternateInstrumentName.instrument_id,
+            AlternateInstrumentName.name
+        ).filter(
+            AlternateInstrumentName.instrument_id.in_(
+                [get_id(row) for row in batch])
+        ).order_by(
+            AlternateInstrumentName.instrument_id,
+            AlternateInstrumentName.index
+        )
+
+        for instrument_id, name in alternates:
+            names.setdefault(instrument_id, []).append(name)
+
+        for row in batch:
+            yield row, names.get(get_id(row), [])
+
+
+InstrumentListing = namedtuple('InstrumentListing',
+                               ['id', 'name', 'alternate_names'])
+
+
+def iter_instrument_listings(categories, batch_size=1000):
+    """Yield each category paired with a lazy iterator of its instruments.
+
+    All instruments are read by a single ordered query whose rows are
+    fetched in batches, so memory use stays constant no matter how many
+    instruments there are.
+
+    Args:
+        categories (list): Category-like objects, ordered by ID.
+        batch_size (int): The number of rows to fetch at a time.
+
+    Yields:
+        tuple[Category, iterator]: A category and an iterator of
+            InstrumentListing tuples, or None if it has no instruments.
+    """
+    rows = db.session.query(
+        Instrument.category_id,
+        Instrument.id,
+        Instrument.name
+    ).order_by(
+        Instrument.category_id,
+        Instrument.name,
+        Instrument.id
+    ).yield_per(batch_size)
+
+    def listings(category_rows):
+        """Convert each instrument's row into a listing."""
+        for (_, instrument_id, name), alternate_names in category_rows:
+            yield InstrumentListing(instrument_id, name, alternate_names)
+
+    rows = iter_with_alternate_names(rows, itemgetter(1))
+
+    groups = groupby(rows, lambda row: row[0][0])
+    category_id, category_rows = next(groups, (None, None))
+
+    for category in categories:
+        # Skip instruments in categories that aren't in `categories`
+        while category_id is not None and category_id < category.id:
+            category_id, category_rows = next(groups, (None, None))
+
+        if category_id == category.id:
+            yield category, listings(category_rows)
+        else:
+            yield category, None
+
+
+@db.event.listens_for(db.session, 'before_flush')
+def touch_updated_instruments(session, flush_context, instances):
+    """Set `updated_at` for instruments whose data is about to change."""
+    now = datetime.utcnow()
+
+    for obj in chain(session.dirty, session.new, session.deleted):
+        if isinstance(obj, Instrument):
+            # Objects can be in `session.dirty` without any real changes
+            instrument = obj if session.is_modified(obj) else None
+        elif isinstance(obj, AlternateInstrumentName) and obj.instrument_id:
+            # Usually found in the session's identity map without a query
+            instrument = session.query(Instrument).get(obj.instrument_id)
+        else:
+            continue
+
+        if instrument is not None and instrument not in session.deleted:
+            instrument.updated_at = now
+
+
+@db.event.listens_for(db.session, 'before_flush')
+def record_deleted_instruments(session, flush_context, instances):
+    """Add a `DeletedInstrument` row for each instrument being deleted."""
+    for obj in list(session.deleted):
+        if isinstance(obj, Instrument):
+            # A row may already exist if SQLite reused a deleted ID
+            session.merge(DeletedInstrument(id=obj.id,
+                                            deleted_at=datetime.utcnow()))
+
+
+def changed_instrument_ids(session):
+    """Return IDs of instruments changed by a flush, including deletions.
+
+    This must be called from an `after_flush` event listener, while the
+    session still shows its state from before the flush.
+    """
+    changed = set()
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Instrument):
+            # Objects can be in `session.dirty` without any real changes
+            if obj not in session.dirty or session.is_modified(obj):
+                changed.add(obj.id)
+        elif isinstance(obj, AlternateInstrumentName):
+            changed.add(obj.instrument_id)
+
+    changed.discard(None)
+    return changed
+
+
+# Streamed export of every instrument
+
+def iter_serialized_instruments(updated_since=None, batch_size=1000):
+    """Yield serialized data for every instrument, ordered by ID.
+
+    Like `iter_instrument_listings()`, this reads a single query in
+    batches so that memory use does not grow with the number of rows.
+
+    Args:
+        updated_since (datetime): If given, only instruments updated at
+                                  or after this (UTC) time are included.
+        batch_size (int): The number of rows to fetch at a time.
+
+    Yields:
+        dict: The same data as `Instrument.serialize()`, plus the time
+              the instrument was last updated, in ISO 8601 format.
+    """
+    rows = db.session.query(
+        Instrument.id,
+        Instrument.name,
+        Instrument.description,
+        Instrument.image,
+        Instrument.image_pending,
+        Instrument.category_id,
+        Instrument.updated_at
+    ).order_by(
+        Instrument.id
+    )
+
+    if updated_since is not None:
+        rows = rows.filter(Instrument.updated_at >= updated_since)
+
+    for columns, alternate_names in iter_with_alternate_names(
+            rows.yield_per(batch_size), itemgetter(0)):
+        (instrument_id, name, description, image, image_pending, category_id,
+         updated) = columns
+
+        yield {
+            'id': instrument_id,
+            'name': name,
+            'description': description,
+            'image': image,
+            'image_pending': image_pending,
+            'category_id': category_id,
+            'alternate_names': alternate_names,
+            'updated_at': updated.isoformat() + 'Z' if updated else None
+        }
+
+
+def iter_deleted_instruments(deleted_since):
+    """Yield a record of each instrument deleted since a time, ordered by ID.
+
+    An instrument is left out if its ID has been reused by a newer one.
+
+    Args:
+        deleted_since (datetime): Only instruments deleted at or after
+                                  this (UTC) time are included.
+
+    Yields:
+        dict: The instrument's ID, `deleted: True`, and the time it was
+              deleted, in ISO 8601 format.
+    """
+    rows = db.session.query(
+        DeletedInstrument.id,
+        DeletedInstrument.deleted_at
+    ).outerjoin(
+        Instrument, Instrument.id == DeletedInstrument.id
+    ).filter(
+        Instrument.id.is_(None),
+        DeletedInstrument.deleted_at >= deleted_since
+    ).order_by(
+        DeletedInstrument.id
+    )
+
+    for instrument_id, deleted_at in rows:
+        yield {
+            'id': instrument_id,
+            'deleted': True,
+            'updated_at': deleted_at.isoformat() + 'Z'
+        }
@@ -0,0 +1,131 @@
+"""
+instrument_catalog.pool
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Configures and measures the database connection pool.
+
+Pool sizes and timeouts use Flask-SQLAlchemy's own settings.  This module
+adds a setting for testing connections before use, and counts how long
+requests wait for a connection, so that a pool which is too small can be
+spotted in a running server.
+"""
+from threading import Lock
+import time
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+from .routing import RoutingSession
+
+
+class PoolStats(object):
+    """Counters for connection checkouts from one pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = Lock()
+
+    def record(self, wait, timed_out=False):
+        """Count one checkout which took `wait` seconds."""
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            if timed_out:
+                self.timeouts += 1
+
+    def stats(self):
+        """Return a dict of the counters, with times in milliseconds."""
+        with self._lock:
+            mean_wait = self.total_wait / self.checkouts \
+                if self.checkouts else 0.0
+
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'mean_wait_ms': round(mean_wait * 1000, 3),
+                'max_wait_ms': round(self.max_wait * 1000, 3)
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A `QueuePool` which records how long each checkout takes.
+
+    The time includes opening a new connection when the pool has none
+    idle, as well as waiting for another thread to return one.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        # Disposing of an engine's connections replaces its pool
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy with extra connection pool options.
+
+    Set `SQLALCHEMY_POOL_PRE_PING` to test each connection as it's checked
+    out, replacing it if the database has closed it.  Sessions can read
+    from replica databases (see `instrument_catalog.routing`).
+    """
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            options['pool_pre_ping'] = True
+
+        # SQLite connections can't be shared between threads, so SQLite
+        # keeps the pool class chosen by Flask-SQLAlchemy
+        if info.drivername != 'sqlite':
+            options['poolclass'] = InstrumentedQueuePool
+
+        return super().apply_driver_hacks(app, info, options)
+
+
+def get_pool_status(engine):
+    """Return a dict describing an engine's connection pool.
+
+    Args:
+        engine (Engine): The engine whose pool is described.
+
+    Returns:
+        dict: Current connection counts (for a `QueuePool`) and the
+              checkout counters (for an `InstrumentedQueuePool`).
+    """
+    pool = engine.pool
+    status = {'pool_class': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            # Starts below zero, counting up as connections are opened
+            'overflow': max(pool.overflow(), 0)
+        })
+
+    if isinstance(pool, InstrumentedQueuePool):
+        status.update(pool.stats.stats())
+
+    return status
@@ -0,0 +1,209 @@
+"""
+instrument_catalog.ratelimit
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Provides rate limit storage which is shared by every worker process.
+
+Importing this module registers a `sqlite://` storage scheme with the
+`limits` package used by Flask-Limiter, for servers whose workers all run
+on one machine.  Servers spread across machines can use the `redis://`
+scheme which `limits` already provides.
+"""
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+import time
+from limits.storage import Storage
+
+
+class SQLiteStorage(Storage):
+    """Rate limit storage in a SQLite database file.
+
+    Supports both the fixed window and moving window strategies.  Each
+    request costs one short transaction, which is safe to run from any
+    number of processes at once.  Expired rows are deleted in batches
+    rather than on every request.
+
+    Hits are written as they happen rather than batched.  Batching would
+    let each process allow hits which other processes haven't seen yet,
+    breaking short limits such as `2/second`.  Each hit takes tens of
+    microseconds, and the transactions are serialized, which limits a
+    machine to roughly ten thousand rate-limited requests per second.
+
+    The URI uses the same form as SQLAlchemy, so
+    `sqlite:////tmp/rate-limits.db` refers to an absolute path.
+    """
+    STORAGE_SCHEME = 'sqlite'
+
+    # Seconds between deletions of expired rows
+    PRUNE_INTERVAL = 60
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS counter ('
+        ' key TEXT PRIMARY KEY, count INTEGER NOT NULL,'
+        ' expires_at REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS entry ('
+        ' key TEXT NOT NULL, acquired_at REAL NOT NULL,'
+        ' expires_at REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS ix_entry_key_acquired_at'
+        ' ON entry (key, acquired_at)',
+        'CREATE INDEX IF NOT EXISTS ix_entry_expires_at ON entry (expires_at)'
+    ]
+
+    def __init__(self, uri, **options):
+        self.path = uri.split('://', 1)[1]
+
+        if self.path.startswith('/'):
+            self.path = self.path[1:]
+
+        self._local = threading.local()
+        self._pruned_at = 0
+        super(SQLiteStorage, self).__init__(uri, **options)
+
+        with self._transaction() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def _connect(self):
+        """Return a connection for the current thread and process."""
+        # Connections can't be shared across a fork or between threads
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return self._local.connection
+
+    @contextmanager
+    def _transaction(self):
+        """Run statements in a transaction which holds the write lock.
+
+        Taking the lock up front means that reading a count and then
+        updating it can't be interleaved with another process.
+        """
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+
+    def _prune(self, connection, now):
+        """Delete expired rows, at most once per `PRUNE_INTERVAL`."""
+        if now - self._pruned_at >= self.PRUNE_INTERVAL:
+            self._pruned_at = now
+            connection.execute('DELETE FROM counter WHERE expires_at <= ?',
+                               (now,))
+            connection.execute('DELETE FROM entry WHERE expires_at <= ?',
+                               (now,))
+
+    # Fixed window strategies
+
+    def incr(self, key, expiry, elastic_expiry=False):
+        """Increment a counter, starting a new window if it has expired.
+
+        Returns:
+            int: The counter's new value.
+        """
+        now = time.time()
+
+        with self._transaction() as connection:
+            self._prune(connection, now)
+            row = connection.execute(
+                'SELECT count, expires_at FROM counter WHERE key = ?',
+                (key,)).fetchone()
+
+            if row is None or row[1] <= now:
+                count, expires_at = 1, now + expiry
+            else:
+                count = row[0] + 1
+                expires_at = now + expiry if elastic_expiry else row[1]
+
+            connection.execute(
+                'INSERT OR REPLACE INTO counter (key, count, expires_at)'
+                ' VALUES (?, ?, ?)', (key, count, expires_at))
+
+        return count
+
+    def get(self, key):
+        """Return a counter's value, or 0 if it has expired."""
+        row = self._connect().execute(
+            'SELECT count FROM counter WHERE key = ? AND expires_at > ?',
+            (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        """Return the time (in seconds since the epoch) a counter expires."""
+        row = self._connect().execute(
+            'SELECT expires_at FROM counter WHERE key = ?',
+            (key,)).fetchone()
+        return int(row[0]) if row else -1
+
+    # Moving window strategy
+
+    def acquire_entry(self, key, limit, expiry, no_add=False):
+        """Record a hit if fewer than `limit` happened in the last `expiry`.
+
+        Only the `limit`th most recent hit needs to be read: if it is still
+        within the window, the limit has been reached.
+
+        Returns:
+            bool: Whether the hit was allowed.
+        """
+        now = time.time()
+
+        with self._transaction() as connection:
+            self._prune(connection, now)
+            row = connection.execute(
+                'SELECT acquired_at FROM entry WHERE key = ?'
+                ' ORDER BY acquired_at DESC LIMIT 1 OFFSET ?',
+                (key, limit - 1)).fetchone()
+
+            if row is not None and row[0] > now - expiry:
+                return False
+
+            if not no_add:
+                connection.execute(
+                    'INSERT INTO entry (key, acquired_at, expires_at)'
+                    ' VALUES (?, ?, ?)', (key, now, now + expiry))
+
+        return True
+
+    def get_moving_window(self, key, limit, expiry):
+        """Return the start of the current window and the hits within it."""
+        now = time.time()
+        start, count = self._connect().execute(
+            'SELECT min(acquired_at), count(*) FROM entry'
+            ' WHERE key = ? AND acquired_at > ?',
+            (key, now - expiry)).fetchone()
+        return int(start if start is not None else now), count
+
+    # Administration
+
+    def check(self):
+        """Return whether the database can be read."""
+        try:
+            self._connect().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        """Remove every stored limit."""
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM counter')
+            connection.execute('DELETE FROM entry')
+
+    def clear(self, key):
+        """Remove the stored state for one limit."""
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM counter WHERE key = ?', (key,))
+            connection.execute('DELETE FROM entry WHERE key = ?', (key,))
@@ -0,0 +1,65 @@
+"""
+instrument_catalog.rendering
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Renders user-supplied markdown as sanitized HTML or plain text.
+"""
+import hashlib
+from flask import Markup
+import bleach
+import mistune
+from .cache import LRUCache
+
+
+markdown = mistune.Markdown(escape=True)  # Users can't enter raw HTML
+
+bleach_args = dict(
+    tags=['a', 'blockquote', 'br', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5',
+          'h6', 'hr', 'li', 'ol', 'p', 'pre', 'strong', 'ul'],
+    attributes={'a': ['href']},
+    protocols=['http', 'https'],
+    strip=False
+)
+
+# Rendered HTML depends on both the markdown source and the bleach settings,
+# so both go into the cache key. Changing `bleach_args` invalidates old items.
+bleach_fingerprint = repr(sorted(bleach_args.items())).encode('utf-8')
+
+render_cache = LRUCache(maxsize=2048)
+
+EXCERPT_LENGTH = 255
+
+
+def render_markdown(data):
+    """Return sanitized HTML for a markdown string, using a cache."""
+    key = 'markdown:' + hashlib.sha1(
+        bleach_fingerprint + data.encode('utf-8')).hexdigest()
+    html = render_cache.get(key)
+
+    if html is None:
+        html = bleach.clean(markdown(data), **bleach_args)
+        render_cache.set(key, html)
+
+    return html
+
+
+def excerpt(html, length=EXCERPT_LENGTH, end='...'):
+    """Return the start of an HTML string's text, cut at a word boundary.
+
+    This produces the same text as the `striptags | truncate` filter
+    combination in Jinja templates, so it can be computed ahead of time.
+
+    Args:
+        html (str): Sanitized HTML, such as from `render_markdown()`.
+        length (int): The maximum length of the returned string.
+        end (str): Text appended when the string has been shortened.
+
+    Returns:
+        str: Plain text with no more than `length` characters.
+    """
+    text = Markup(html).striptags()
+
+    if len(text) <= length:
+        return text
+
+    return text[:length - len(end)].rsplit(' ', 1)[0] + end
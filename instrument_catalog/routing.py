@@ -0,0 +1,128 @@
+"""
+instrument_catalog.routing
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Sends read-only requests' queries to read replicas of the database.
+
+Replicas are extra Flask-SQLAlchemy binds, named by the app's
+`DATABASE_REPLICA_BINDS` setting.  A query goes to a replica only when
+all of these are true:
+
+- It runs while handling a GET, HEAD or OPTIONS request.
+- Nothing has been written to the database during the request.
+- The code running it hasn't asked for the primary with `using_primary()`.
+- The same client hasn't written anything in the last
+  `DATABASE_REPLICA_LAG` seconds.
+
+The last rule means clients always see their own changes, even though
+replicas may lag behind the primary.  Everything else, including every
+query outside of a request, uses the primary database.
+"""
+from contextlib import contextmanager
+import hashlib
+import random
+import time
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession
+from werkzeug.contrib.cache import SimpleCache
+
+
+READ_ONLY_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Marks clients sending an `Authorization` header (such as API clients,
+# which usually don't keep cookies) that wrote recently.  Set to a shared
+# cache when several processes serve requests; otherwise, only the process
+# which handled a write keeps that client on the primary.
+recent_writers = SimpleCache(threshold=4096)
+
+
+def get_writer_key():
+    """Return a cache key for the client sending an `Authorization` header.
+
+    The header is hashed, so that credentials aren't stored as keys.
+    """
+    header = request.headers['Authorization'].encode('utf-8')
+    return 'recent-writer:' + hashlib.sha256(header).hexdigest()
+
+
+def wrote_recently():
+    """Return whether the current client has written within the lag time."""
+    if 'Authorization' in request.headers:
+        return bool(recent_writers.get(get_writer_key()))
+    else:
+        return session.get('primary_until', 0) > time.time()
+
+
+def remember_writes(response):
+    """Keep a client on the primary database for a while after it writes.
+
+    This must be registered as an `after_request` function.
+    """
+    if g.get('database_written'):
+        lag = current_app.config['DATABASE_REPLICA_LAG']
+
+        if 'Authorization' in request.headers:
+            recent_writers.set(get_writer_key(), True, timeout=lag)
+        else:
+            session['primary_until'] = time.time() + lag
+
+    return response
+
+
+class RoutingSession(SignallingSession):
+    """A session which reads from a replica when that's safe.
+
+    The replica is chosen once per session, so every query while handling
+    a request sees the same replica.
+    """
+    def __init__(self, db, *args, **kwargs):
+        self.db = db
+        self._primary_depth = 0
+        super().__init__(db, *args, **kwargs)
+
+    @contextmanager
+    def using_primary(self):
+        """Run the queries within this block on the primary database.
+
+        Use this for reads whose results are kept after the request, such
+        as cached data, which must never come from a replica that is
+        behind the primary.
+        """
+        self._primary_depth += 1
+
+        try:
+            yield self
+        finally:
+            self._primary_depth -= 1
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self._get_replica()
+
+        if replica is not None:
+            return self.db.get_engine(self.app, bind=replica)
+
+        return super().get_bind(mapper, clause)
+
+    def _get_replica(self):
+        """Return the bind key of the replica to use, or None."""
+        replicas = self.app.config.get('DATABASE_REPLICA_BINDS')
+
+        if not replicas or self._flushing or self._primary_depth \
+                or not has_request_context() \
+                or request.method not in READ_ONLY_METHODS \
+                or g.get('database_written') or wrote_recently():
+            return None
+
+        if 'replica' not in self.info:
+            self.info['replica'] = random.choice(replicas)
+
+        return self.info['replica']
+
+
+def note_database_write(session, flush_context):
+    """Read the rest of this request's data from the primary database.
+
+    This must be registered as an `after_flush` session event listener.
+    """
+    if has_request_context():
+        g.database_written = True
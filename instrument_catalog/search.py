@@ -0,0 +1,188 @@
+"""
+instrument_catalog.search
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Maintains and queries a full-text search index of instruments.
+
+The index is a separate table with one row per instrument, covering the
+instrument's name, alternate names, and description.  With SQLite it is
+an FTS5 virtual table; with PostgreSQL it holds a `tsvector` column with
+a GIN index.  Rows are rewritten in the same transaction as any change
+to an instrument or its alternate names.
+"""
+import re
+from sqlalchemy import bindparam, text
+from .models import db, Instrument, changed_instrument_ids
+
+
+# Column weights: a match in a name ranks far above one in a description
+SQLITE_STATEMENTS = {
+    'create': [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS instrument_search USING fts5('
+        'name, alternate_names, description,'
+        " tokenize = 'unicode61 remove_diacritics 1')"
+    ],
+    'drop': ['DROP TABLE IF EXISTS instrument_search'],
+    'delete': 'DELETE FROM instrument_search WHERE rowid IN :ids',
+    'delete_all': 'DELETE FROM instrument_search',
+    'insert': (
+        'INSERT INTO instrument_search'
+        ' (rowid, name, alternate_names, description)'
+        ' SELECT instrument.id, instrument.name,'
+        " coalesce((SELECT group_concat(alt.name, ' ')"
+        '  FROM alternate_instrument_name AS alt'
+        '  WHERE alt.instrument_id = instrument.id), \'\'),'
+        ' instrument.description'
+        ' FROM instrument'
+    ),
+    'search': (
+        'SELECT rowid FROM instrument_search'
+        ' WHERE instrument_search MATCH :query'
+        ' ORDER BY bm25(instrument_search, 10.0, 5.0, 1.0), rowid'
+        ' LIMIT :limit OFFSET :offset'
+    ),
+}
+
+POSTGRESQL_STATEMENTS = {
+    'create': [
+        'CREATE TABLE IF NOT EXISTS instrument_search ('
+        ' instrument_id INTEGER PRIMARY KEY'
+        '  REFERENCES instrument (id) ON DELETE CASCADE,'
+        ' document TSVECTOR NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS ix_instrument_search_document'
+        ' ON instrument_search USING GIN (document)'
+    ],
+    'drop': ['DROP TABLE IF EXISTS instrument_search'],
+    'delete': 'DELETE FROM instrument_search WHERE instrument_id IN :ids',
+    'delete_all': 'DELETE FROM instrument_search',
+    'insert': (
+        'INSERT INTO instrument_search (instrument_id, document)'
+        ' SELECT instrument.id,'
+        " setweight(to_tsvector('simple', instrument.name), 'A')"
+        " || setweight(to_tsvector('simple', coalesce("
+        "   (SELECT string_agg(alt.name, ' ')"
+        '    FROM alternate_instrument_name AS alt'
+        "    WHERE alt.instrument_id = instrument.id), '')), 'B')"
+        " || setweight(to_tsvector('simple', instrument.description), 'D')"
+        ' FROM instrument'
+    ),
+    'search': (
+        'SELECT instrument_id FROM instrument_search,'
+        " to_tsquery('simple', :query) AS query"
+        ' WHERE document @@ query'
+        ' ORDER BY ts_rank(document, query) DESC, instrument_id'
+        ' LIMIT :limit OFFSET :offset'
+    ),
+}
+
+
+def get_statements(bind):
+    """Return the SQL statements for a connection or engine's database."""
+    if bind.dialect.name == 'postgresql':
+        return POSTGRESQL_STATEMENTS
+    else:
+        return SQLITE_STATEMENTS
+
+
+def to_search_query(bind, string):
+    """Convert user input into a query for the database's search syntax.
+
+    Every word must match, and the last word also matches as a prefix so
+    that results appear while a word is still being typed.
+
+    Returns:
+        str: The query, or None if `string` contains no words.
+    """
+    words = re.findall(r'\w+', string.lower())
+
+    if not words:
+        return None
+
+    if bind.dialect.name == 'postgresql':
+        terms = ["'{}'".format(word) for word in words]
+        terms[-1] += ':*'
+        return ' & '.join(terms)
+    else:
+        terms = ['"{}"'.format(word) for word in words]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+
+def create_index(bind):
+    """Create the search table (if needed) and fill it with every row."""
+    statements = get_statements(bind)
+
+    for statement in statements['create']:
+        bind.execute(text(statement))
+
+    bind.execute(text(statements['delete_all']))
+    bind.execute(text(statements['insert']))
+
+
+def drop_index(bind):
+    """Remove the search table."""
+    for statement in get_statements(bind)['drop']:
+        bind.execute(text(statement))
+
+
+def reindex_instruments(connection, instrument_ids):
+    """Rewrite the search index rows for some instruments.
+
+    Rows for deleted instruments are simply removed.
+    """
+    statements = get_statements(connection)
+    ids = list(instrument_ids)
+
+    delete = text(statements['delete'])\
+        .bindparams(bindparam('ids', expanding=True))
+    insert = text(statements['insert'] + ' WHERE instrument.id IN :ids')\
+        .bindparams(bindparam('ids', expanding=True))
+
+    connection.execute(delete, ids=ids)
+    connection.execute(insert, ids=ids)
+
+
+def search_instruments(string, limit, offset=0):
+    """Return instruments matching a search, best matches first.
+
+    Args:
+        string (str): Words to search for, as typed by a user.
+        limit (int): The maximum number of instruments to return.
+        offset (int): The number of best matches to skip.
+
+    Returns:
+        list[Instrument]: The matching instruments.
+    """
+    query = to_search_query(db.session.connection(), string)
+
+    if query is None:
+        return []
+
+    statement = text(get_statements(db.session.connection())['search'])
+    ids = [row[0] for row in db.session.execute(
+        statement, dict(query=query, limit=limit, offset=offset))]
+
+    if not ids:
+        return []
+
+    instruments = Instrument.query.filter(Instrument.id.in_(ids)).all()
+    rank = {instrument_id: index for index, instrument_id in enumerate(ids)}
+    return sorted(instruments, key=lambda instrument: rank[instrument.id])
+
+
+# Keeping the index current
+
+@db.event.listens_for(db.session, 'after_flush')
+def note_search_changes(session, flush_context):
+    """Remember which instruments need to be reindexed."""
+    session.info.setdefault('search_changes', set())\
+        .update(changed_instrument_ids(session))
+
+
+@db.event.listens_for(db.session, 'after_flush_postexec')
+def update_search_index(session, flush_context):
+    """Reindex changed instruments within the flush's transaction."""
+    changed = session.info.pop('search_changes', None)
+
+    if changed:
+        reindex_instruments(session.connection(), changed)
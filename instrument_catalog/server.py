@@ -4,14 +4,17 @@ instrument_catalog.server
 
 Defines server routes, including main application logic.
 """
-from flask import (Flask, Markup, flash, render_template, request, redirect,
-                   session, url_for)
+from flask import (Flask, Response, flash, render_template, request,
+                   redirect, session, stream_with_context, url_for)
 from flask_login import current_user, login_required
-import bleach
-import mistune
 from . import api
 from . import auth
-from .models import db, User, Category, Instrument, AlternateInstrumentName
+from . import internal
+from .conditional import (conditional_response, has_flashed_messages,
+                          make_etag)
+from .models import (db, User, Category, Instrument, AlternateInstrumentName,
+                     category_snapshot, iter_instrument_listings)
+from .search import search_instruments
 from .validation import get_validated_instrument_data
 
 
@@ -20,28 +23,27 @@ app.register_blueprint(api.bp, url_prefix='/api')
 app.register_blueprint(api.documentation_bp, url_prefix='/apidoc')
 app.register_blueprint(auth.bp, url_prefix='')
 app.register_blueprint(auth.google_bp, url_prefix='/auth')
+app.register_blueprint(internal.bp, url_prefix='/internal')
 
-markdown = mistune.Markdown(escape=True)  # Users can't enter raw HTML
 
-bleach_args = dict(
-    tags=['a', 'blockquote', 'br', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5',
-          'h6', 'hr', 'li', 'ol', 'p', 'pre', 'strong', 'ul'],
-    attributes={'a': ['href']},
-    protocols=['http', 'https'],
-    strip=False
-)
+def stream_template(template_name, **context):
+    """Return an iterator of strings which make up a rendered template.
 
-
-@app.template_filter('markdown')
-def markdown_filter(data, inline=False):
-    """Markdown filter for use in HTML templates."""
-    return Markup(bleach.clean(markdown(data), **bleach_args))
+    The response can start being sent before rendering is finished,
+    which keeps the time to first byte short for very long pages.
+    """
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(20)  # Send chunks of several template pieces
+    return stream
 
 
 @app.context_processor
 def inject_template_data():
     """Provide category data used by base template for every request."""
-    return dict(categories=Category.query.order_by(Category.id).all())
+    # This is a cached snapshot, so most requests don't query the database
+    return dict(categories=category_snapshot.get())
 
 
 @app.errorhandler(404)
@@ -61,7 +63,8 @@ def index():
 @app.route('/categories/')
 def all_categories():
     """Display a list of all instrument categories."""
-    # No db query -- category data is injected automatically for all requests
+    # No db query -- a category snapshot is injected automatically for all
+    # requests and includes each category's rendered description
     return render_template('all_categories.html')
 
 
@@ -79,21 +82,50 @@ def one_category(category_id):
 @app.route('/instruments/')
 def all_instruments():
     """Display a list of all instruments in all categories."""
-    # No db query -- category data is injected automatically for all requests
-    # and instrument data is associated with each category.
-    # TODO If app scales, we'll want to manually query using `yield_per()`.
-    return render_template('all_instruments.html')
+    # Instruments are read from the database while the page is being sent
+    listings = iter_instrument_listings(category_snapshot.get())
+    return Response(stream_with_context(
+        stream_template('all_instruments.html', listings=listings)))
 
 
 @app.route('/instruments/<int:instrument_id>/')
 def one_instrument(instrument_id):
     """Display information about a given instrument."""
-    instrument = Instrument.query.get(instrument_id)
+    last_modified = Instrument.get_updated_at(instrument_id)
 
-    if instrument is None:
+    if last_modified is None:
         return not_found()
 
-    return render_template('one_instrument.html', instrument=instrument)
+    def render():
+        instrument = Instrument.query.get(instrument_id)
+        return render_template('one_instrument.html', instrument=instrument)
+
+    if has_flashed_messages():
+        return render()
+
+    # The page also depends on the user, the menu, and the templates.  Only
+    # the ETag covers all of those, so no Last-Modified time is sent.
+    etag = make_etag('one_instrument', instrument_id,
+                     last_modified.isoformat(), current_user.get_id(),
+                     category_snapshot.get_version()[0],
+                     app.config['RELEASE_VERSION'])
+    return conditional_response(etag, None, render, private=True)
+
+
+@app.route('/search')
+def search():
+    """Display instruments matching a search query."""
+    results_per_page = 20
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+
+    # Fetch one extra result to find out whether there is another page
+    results = search_instruments(query, results_per_page + 1,
+                                 (max(page, 1) - 1) * results_per_page)
+
+    return render_template('search.html', query=query, page=page,
+                           instruments=results[:results_per_page],
+                           more_results=len(results) > results_per_page)
 
 
 @app.route('/instruments/new', methods=['GET', 'POST'])
@@ -116,7 +148,8 @@ def new_instrument():
                                 description=data['description'],
                                 category_id=data['category_id'],
                                 user_id=current_user.id,
-                                image=data['image'] or None)
+                                image=data['image'] or None,
+                                image_pending=data.get('image_pending', False))
 
         if 'alternate_names' in data:
             instrument.alternate_names.extend(
@@ -167,27 +200,7 @@ def edit_instrument(instrument_id):
             if not key == 'alternate_names':  # Goes in a different table
                 setattr(instrument, key, value)
 
-        # Update alternate names unless they haven't been changed at all
-        new_alt_names = data.get('alternate_names', [])
-        old_alt_names = [alt.name for alt in instrument.alternate_names]
-
-        if not new_alt_names == old_alt_names:
-            # Make sure we don't have more rows than new alternate names
-            del instrument.alternate_names[len(new_alt_names):]
-            # TODO Identify and update existing names to enable atomic commit
-            # We need to commit now, before modifying or adding names, to avoid
-            # failing a UNIQUE constraint in some situations (e.g. re-ordering
-            # rows). This prevents the edit from being atomic, unfortunately.
-            db.session.commit()
-
-            # Update or create new alternate names as needed
-            for index, name in enumerate(new_alt_names):
-                try:
-                    instrument.alternate_names[index].name = name
-                except IndexError:
-                    instrument.alternate_names.append(
-                        AlternateInstrumentName(name=name, index=index))
-
+        instrument.set_alternate_names(data.get('alternate_names', []))
         db.session.commit()
 
         return (
@@ -0,0 +1,63 @@
+"""
+instrument_catalog.startup
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Prepares the database and each server process before requests arrive.
+
+Seeding runs once per deployment, from the `flask seed-database` command.
+Warming up runs in every worker process (see `gunicorn.conf.py`), so that
+the first visitor to each worker doesn't wait for queries, template
+compilation, or imports which every later request would reuse.
+"""
+import bleach
+from .models import db, Category, category_snapshot
+from .api import api_reference
+from .autocomplete import name_snapshot
+from .rendering import bleach_args, markdown
+
+
+def seed_database():
+    """Add seed data to the database if it has no categories.
+
+    Returns:
+        bool: Whether seed data was added.
+    """
+    if db.session.query(Category.query.exists()).scalar():
+        return False
+
+    from . import db_init
+    db_init.init()
+    return True
+
+
+def warm_up(app, connections=1):
+    """Load everything a process would otherwise load on its first requests.
+
+    Args:
+        app (Flask): The application to warm up.
+        connections (int): The number of database connections to open and
+                           leave in the connection pool, usually one for
+                           each thread serving requests.
+    """
+    with app.app_context():
+        # Connections go back to the pool when closed, ready for requests
+        for bind in [None] + app.config['DATABASE_REPLICA_BINDS']:
+            engine = db.get_engine(app, bind)
+            opened = [engine.connect() for _ in range(connections)]
+
+            for connection in opened:
+                connection.close()
+
+        category_snapshot.get()
+        name_snapshot.get()
+        db.session.remove()
+
+    # Compiled templates are cached by the Jinja environment
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+    # The first call builds parsers which every later call reuses
+    bleach.clean(markdown('Warm *up*'), **bleach_args)
+
+    # Rendered only once per process, with pygments highlighting
+    api_reference()
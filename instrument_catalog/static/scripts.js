@@ -26,7 +26,8 @@ function main() {
 
 // Instrument form functionality
 (function () {
-    var MAX_ALT_INSTRUMENT_NAMES = 10;
+    var MAX_ALT_INSTRUMENT_NAMES = 500; // Must match the server's limit
+    var nextAltNameIndex = 1; // Indexes aren't reused after a deletion
     var form = document.forms.instrumentForm;
     var formFields;
 
@@ -41,12 +42,14 @@ function main() {
 
     function addAltNameElement(event) {
         var listItems = formFields.altNames_fieldset.getElementsByTagName('li');
-        var newIndex = listItems.length;
+        var newIndex = nextAltNameIndex;
         var newListItem = listItems[0].cloneNode(true);
         var newLabel = newListItem.getElementsByTagName('label')[0]
         var newInput = newListItem.getElementsByTagName('input')[0];
         var deleteBtn = document.createElement('button');
 
+        nextAltNameIndex += 1;
+
         // Update and reset values of copied elements
         newLabel.setAttribute('for', 'altName' + newIndex);
         newInput.setAttribute('id', 'altName' + newIndex);
@@ -123,19 +126,15 @@ function main() {
     // Use event delegation to catch events triggered by contained `<input>`s
     formFields.altNames_fieldset.addEventListener('input', function (event) {
         var uniqueNames = []; // Instrument names already used in the form
+        var elements = formFields.altNames_fieldset
+            .getElementsByTagName('input');
         var i, element, name; // Loop variables
 
         // Include the primary instrument name to prevent duplicating it
         uniqueNames.push(collapseSpaces(formFields.name.value));
 
-        // Check all elements, up to our preset limit
-        for (i = 0; i < MAX_ALT_INSTRUMENT_NAMES; i += 1) {
-            element = formFields['altName' + i];
-
-            if (!element) {
-                break; // No more names to check
-            }
-
+        for (i = 0; i < elements.length; i += 1) {
+            element = elements[i];
             name = collapseSpaces(element.value);
 
             if (!name) {
@@ -4,11 +4,39 @@ instrument_catalog.validation
 
 Validates user input from instrument create/edit form or from the API.
 """
+from concurrent.futures import ThreadPoolExecutor
 import re
-from flask import flash, request
+from threading import Lock
+from flask import current_app, flash
 import requests
 from requests import Timeout, ConnectionError
-from .models import Category, Instrument, AlternateInstrumentName
+from requests.adapters import HTTPAdapter
+from werkzeug.contrib.cache import SimpleCache
+from .models import Instrument, AlternateInstrumentName, category_snapshot
+
+
+MAX_IMAGE_CHECK_THREADS = 8
+MAX_ALTERNATE_NAMES = 500
+
+# Seconds to wait for an image host to answer
+IMAGE_CHECK_TIMEOUT = 2.0
+
+# Reuse connections (and TLS sessions) to image hosts between requests
+http_session = requests.Session()
+http_session.headers['User-Agent'] = 'instrument-catalog'
+http_session.mount('http://',
+                   HTTPAdapter(pool_maxsize=MAX_IMAGE_CHECK_THREADS))
+http_session.mount('https://',
+                   HTTPAdapter(pool_maxsize=MAX_IMAGE_CHECK_THREADS))
+
+# Results of checking image URLs expire after 10 minutes. Executor threads
+# use the cache at the same time, and SimpleCache isn't thread-safe (adding
+# an item can prune others while another thread is adding one), so every
+# use holds the lock.
+image_url_cache = SimpleCache(threshold=2048, default_timeout=10 * 60)
+image_url_cache_lock = Lock()
+
+image_url_executor = ThreadPoolExecutor(max_workers=MAX_IMAGE_CHECK_THREADS)
 
 
 def collapse_spaces(string=None, markdown_compatible=False):
@@ -52,25 +80,111 @@ def get_alternate_instrument_names(data):
             flash('`alternate_names` must be an array of strings.')
             alt_names = []
 
-    # With the HTML form, each alternate name is a separate field
+    # With the HTML form, each alternate name is a separate field.  Fields
+    # can be deleted from the page, so their numbers may have gaps.
     else:
-        alt_names = []
+        fields = []
 
-        # The HTML form only allows 10 alternate names
-        for index in range(10):
-            name_key = 'alt_name_{}'.format(index)
+        for key in data:
+            match = re.fullmatch(r'alt_name_(\d+)', key)
 
-            if name_key not in data:
-                break
+            if match:
+                fields.append((int(match.group(1)), key))
 
+        alt_names = []
+
+        for _, name_key in sorted(fields):
             name = collapse_spaces(str(data.get(name_key, '')))
 
-            if name is not '':
+            if name != '':
                 alt_names.append(name)
 
     return alt_names
 
 
+def check_image_url(url):
+    """Return the result of checking an image URL, using a cache.
+
+    This does not use the request context, so it can be called from
+    any thread.
+
+    Args:
+        url (str): The image URL to check, which must start with "http".
+
+    Returns:
+        tuple[str, str]: The image URL (which may be different from what
+                         was passed in if the host server sent a redirect
+                         status code) and an error message, or None if
+                         the image is valid.
+    """
+    cache_key = 'image-url:' + url
+
+    with image_url_cache_lock:
+        result = image_url_cache.get(cache_key)
+
+    if result is not None:
+        return result
+
+    try:
+        response = http_session.head(url, timeout=IMAGE_CHECK_TIMEOUT,
+                                     allow_redirects=True)
+    # Test: Image host server responds
+    except (Timeout, ConnectionError):
+        # Don't cache this result, since the server may just be busy
+        return url, ('Image URL: The image server could not be reached.'
+                     ' Double check the URL or try a different one.')
+
+    error = None
+
+    # Test: Image server returns successful response
+    if response.status_code != 200:
+        error = ('Image URL: A request for the image failed'
+                 ' with status code {}.'.format(response.status_code))
+
+    # Test: Image has a supported filetype
+    elif (response.headers.get('Content-Type') or '').lower() not in (
+            'image/jpeg', 'image/png', 'image/gif'):
+        error = 'Image URL: The image must be a jpg, png, or gif.'
+
+    else:
+        # Test: Content-Length exists and is smaller than 300 KB
+        content_length = int(response.headers.get('Content-Length', 0))
+
+        if not 0 < content_length < 1024 * 300:
+            error = 'Image URL: The image must be under 300 KB.'
+
+        # Update the URL in case there was a redirect (we waited to
+        # confirm that the URL was valid before doing this)
+        url = response.url
+
+    with image_url_cache_lock:
+        image_url_cache.set(cache_key, (url, error))
+
+    return url, error
+
+
+def image_check_is_cached(url):
+    """Return whether `check_image_url(url)` would use a cached result."""
+    with image_url_cache_lock:
+        return image_url_cache.has('image-url:' + url)
+
+
+def check_image_urls(urls):
+    """Check several image URLs concurrently, caching the results.
+
+    Later calls to `validate_image_url()` for any of these URLs will use
+    the cached results instead of waiting for each server in turn.
+
+    Args:
+        urls (iterable): Image URLs as submitted, before normalization.
+    """
+    urls = set(collapse_spaces(str(url)) for url in urls if url)
+    urls = [url for url in urls if url.startswith('http')]
+
+    # Wait for every check to finish before returning
+    list(image_url_executor.map(check_image_url, urls))
+
+
 def validate_image_url(url):
     """Return validity of an image URL and the result of any redirection.
 
@@ -82,48 +196,18 @@ def validate_image_url(url):
                           may be different from what was passed in if
                           the host server sent a redirect status code.
     """
-    is_valid = True
-
     # Test: URL uses http(s)
     if not url.startswith('http'):
-        is_valid = False
         flash('Image URL: URL must start with "http" or "https"')
-    else:
-        headers = {'user-agent': 'instrument-catalog'}
-        try:
-            response = requests.head(url, headers=headers, timeout=2.0,
-                                     allow_redirects=True)
-        # Test: Image host server responds
-        except (Timeout, ConnectionError):
-            is_valid = False
-            flash('Image URL: The image server could not be reached.'
-                  ' Double check the URL or try a different one.')
-        else:
-            # Test: Image server returns successful response
-            if response.status_code is not 200:
-                is_valid = False
-                flash('Image URL: A request for the image failed'
-                      ' with status code {}.'.format(response.status_code))
+        return url, False
 
-            # Test: Image has a supported filetype
-            elif response.headers.get('Content-Type').lower() not in (
-                    'image/jpeg', 'image/png', 'image/gif'):
-                is_valid = False
-                flash('Image URL: The image must be a jpg, png, or gif.')
+    checked_url, error = check_image_url(url)
 
-            else:
-                # Test: Content-Length exists and is smaller than 300 KB
-                content_length = int(response.headers.get('Content-Length', 0))
+    if error is not None:
+        flash(error)
+        return url, False
 
-                if not 0 < content_length < 1024 * 300:
-                    is_valid = False
-                    flash('Image URL: The image must be under 300 KB.')
-
-                # Update the URL in case there was a redirect (we waited to
-                # confirm that the URL was valid before doing this)
-                url = response.url
-
-    return url, is_valid
+    return checked_url, True
 
 
 def get_validated_instrument_data(data, existing_instrument=None):
@@ -133,8 +217,10 @@ def get_validated_instrument_data(data, existing_instrument=None):
     the website form or through the API.
 
     Args:
-        existing_instrument (Instrument): An optional argument, only
-            needed when the key 'name' is not included in `data`.
+        data (dict): Submitted instrument data.
+        existing_instrument (dict): The serialized instrument which is
+            being updated, if any. When given, `data` only needs to
+            include the values being changed.
 
     Returns:
         tuple[dict, bool]: The normalized data and whether it is valid.
@@ -157,7 +243,8 @@ def get_validated_instrument_data(data, existing_instrument=None):
                 markdown_compatible=(key == 'description'))
 
     alternate_names = get_alternate_instrument_names(data)
-    if alternate_names:
+    # An empty list from the API means that all alternate names are removed
+    if alternate_names or isinstance(data.get('alternate_names'), list):
         instrument['alternate_names'] = alternate_names
 
     # Reference variables
@@ -169,8 +256,8 @@ def get_validated_instrument_data(data, existing_instrument=None):
 
     # Test: All required fields are present (and not blank)
     if not required_columns.issubset(input_columns):
-        # PUT requests do not need to specify all fields, only those to update
-        if request.method != 'PUT':
+        # Updates do not need to specify all fields, only those to change
+        if existing_instrument is None:
             is_valid = False
             flash('Required data is missing: {columns}'
                   .format(columns=', '.join(required_columns - input_columns)))
@@ -185,7 +272,7 @@ def get_validated_instrument_data(data, existing_instrument=None):
             if len(instrument[column]) > length_limit:
                 is_valid = False
                 flash('Provided {field} is over the limit of {num} characters.'
-                      .format(field=column, num=limit))
+                      .format(field=column, num=length_limit))
 
     if 'alternate_names' in instrument:
         # Test: No alternate name is over the character limit
@@ -198,7 +285,8 @@ def get_validated_instrument_data(data, existing_instrument=None):
                       ' {num} characters.'.format(name=name, num=length_limit))
 
         # Test: Alternate names do not duplicate primary name
-        instrument_name = instrument.get('name', existing_instrument.id)
+        instrument_name = instrument.get('name') or \
+            (existing_instrument or {}).get('name')
 
         if instrument_name in instrument['alternate_names']:
             is_valid = False
@@ -209,12 +297,13 @@ def get_validated_instrument_data(data, existing_instrument=None):
             is_valid = False
             flash('Alternate names must not duplicate other alternate names.')
 
-        # Test: There are no more than 10 alternate names
-        if len(alternate_names) > 10:
+        # Test: There are not too many alternate names
+        if len(alternate_names) > MAX_ALTERNATE_NAMES:
             is_valid = False
-            flash('You can not specify more than 10 alternate names.')
+            flash('You can not specify more than {} alternate names.'
+                  .format(MAX_ALTERNATE_NAMES))
 
-    if instrument['category_id']:
+    if instrument.get('category_id'):
         # If the value is '', it has already been reported as missing
         try:
             # Test: Category ID is an integer (NOTE '1.2' becomes 1)
@@ -223,16 +312,29 @@ def get_validated_instrument_data(data, existing_instrument=None):
             is_valid = False
             flash('An invalid category ID was provided.')
         else:
-            # Test: Category exists in the database
-            if Category.query.get(instrument['category_id']) is None:
+            # Test: Category exists (checked without querying the database)
+            category_ids = {cat.id for cat in category_snapshot.get()}
+
+            if instrument['category_id'] not in category_ids:
                 is_valid = False
                 flash('An invalid category ID was provided.')
 
-    if instrument['image']:
-        # Test: Image URL is valid and meets our requirements
-        validated_url, image_is_valid = validate_image_url(instrument['image'])
+    if 'image' in instrument:
+        instrument['image_pending'] = False
+
+    if instrument.get('image'):
+        url = instrument['image']
+
+        if (current_app.config.get('ASYNC_IMAGE_VALIDATION')
+                and url.startswith('http') and not image_check_is_cached(url)):
+            # Save without waiting for the image host. The URL is checked in
+            # the background once the instrument has been committed.
+            instrument['image_pending'] = True
+        else:
+            # Test: Image URL is valid and meets our requirements
+            validated_url, image_is_valid = validate_image_url(url)
 
-        instrument['image'] = validated_url
-        is_valid = is_valid and image_is_valid
+            instrument['image'] = validated_url
+            is_valid = is_valid and image_is_valid
 
     return instrument, is_valid
@@ -0,0 +1,67 @@
+"""Add full-text search index for instruments
+
+Revision ID: 5f2d8a61c9e3
+Revises: e4a93c07d6b1
+Create Date: 2026-10-18 18:05:12.630458
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2d8a61c9e3'
+down_revision = 'e4a93c07d6b1'
+branch_labels = None
+depends_on = None
+
+
+# The search table differs between SQLite (FTS5) and PostgreSQL (GIN), and
+# autogenerate can't describe it, so it's written out here as it was when
+# this revision was made
+SQLITE_UPGRADE = [
+    'CREATE VIRTUAL TABLE IF NOT EXISTS instrument_search USING fts5('
+    'name, alternate_names, description,'
+    " tokenize = 'unicode61 remove_diacritics 1')",
+    'DELETE FROM instrument_search',
+    'INSERT INTO instrument_search'
+    ' (rowid, name, alternate_names, description)'
+    ' SELECT instrument.id, instrument.name,'
+    " coalesce((SELECT group_concat(alt.name, ' ')"
+    '  FROM alternate_instrument_name AS alt'
+    '  WHERE alt.instrument_id = instrument.id), \'\'),'
+    ' instrument.description'
+    ' FROM instrument'
+]
+
+POSTGRESQL_UPGRADE = [
+    'CREATE TABLE IF NOT EXISTS instrument_search ('
+    ' instrument_id INTEGER PRIMARY KEY'
+    '  REFERENCES instrument (id) ON DELETE CASCADE,'
+    ' document TSVECTOR NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS ix_instrument_search_document'
+    ' ON instrument_search USING GIN (document)',
+    'DELETE FROM instrument_search',
+    'INSERT INTO instrument_search (instrument_id, document)'
+    ' SELECT instrument.id,'
+    " setweight(to_tsvector('simple', instrument.name), 'A')"
+    " || setweight(to_tsvector('simple', coalesce("
+    "   (SELECT string_agg(alt.name, ' ')"
+    '    FROM alternate_instrument_name AS alt'
+    "    WHERE alt.instrument_id = instrument.id), '')), 'B')"
+    " || setweight(to_tsvector('simple', instrument.description), 'D')"
+    ' FROM instrument'
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        statements = POSTGRESQL_UPGRADE
+    else:
+        statements = SQLITE_UPGRADE
+
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS instrument_search')
@@ -0,0 +1,27 @@
+"""Add instrument indexes for sorted listings
+
+Revision ID: 7a1f5c3e8b24
+Revises: d94b7e3a2f60
+Create Date: 2026-10-18 20:31:52.207614
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7a1f5c3e8b24'
+down_revision = 'd94b7e3a2f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_instrument_category_id_name', 'instrument', ['category_id', 'name', 'id'], unique=False)
+    op.create_index('ix_instrument_user_id_name', 'instrument', ['user_id', 'name', 'id'], unique=False)
+    op.create_index('ix_instrument_name', 'instrument', ['name', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_instrument_name', table_name='instrument')
+    op.drop_index('ix_instrument_user_id_name', table_name='instrument')
+    op.drop_index('ix_instrument_category_id_name', table_name='instrument')
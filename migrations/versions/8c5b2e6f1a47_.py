@@ -0,0 +1,37 @@
+"""Add rendered description columns
+
+Revision ID: 8c5b2e6f1a47
+Revises: 30e51518114a
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c5b2e6f1a47'
+down_revision = '30e51518114a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are filled in by running `flask backfill-descriptions`
+    with op.batch_alter_table('category') as batch_op:
+        batch_op.add_column(sa.Column('description_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('description_excerpt', sa.String(length=255), nullable=True))
+
+    with op.batch_alter_table('instrument') as batch_op:
+        batch_op.add_column(sa.Column('description_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('description_excerpt', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('instrument') as batch_op:
+        batch_op.drop_column('description_excerpt')
+        batch_op.drop_column('description_html')
+
+    with op.batch_alter_table('category') as batch_op:
+        batch_op.drop_column('description_excerpt')
+        batch_op.drop_column('description_html')
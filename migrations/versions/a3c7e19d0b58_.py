@@ -0,0 +1,26 @@
+"""Add user rate_limit_tier column
+
+Revision ID: a3c7e19d0b58
+Revises: 5f2d8a61c9e3
+Create Date: 2026-10-18 18:02:11.402318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c7e19d0b58'
+down_revision = '5f2d8a61c9e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('rate_limit_tier', sa.String(length=32), nullable=False, server_default='standard'))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('rate_limit_tier')
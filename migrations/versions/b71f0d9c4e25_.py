@@ -0,0 +1,31 @@
+"""Add instrument updated_at column
+
+Revision ID: b71f0d9c4e25
+Revises: 8c5b2e6f1a47
+Create Date: 2026-10-18 13:47:05.218693
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71f0d9c4e25'
+down_revision = '8c5b2e6f1a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('instrument') as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_instrument_updated_at'), ['updated_at'], unique=False)
+
+    # We don't know when existing rows were last changed, so use "now"
+    op.execute('UPDATE instrument SET updated_at = CURRENT_TIMESTAMP')
+
+
+def downgrade():
+    with op.batch_alter_table('instrument') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_instrument_updated_at'))
+        batch_op.drop_column('updated_at')
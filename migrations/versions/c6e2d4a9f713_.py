@@ -0,0 +1,37 @@
+"""Add api_key table
+
+Revision ID: c6e2d4a9f713
+Revises: a3c7e19d0b58
+Create Date: 2026-10-18 19:10:37.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e2d4a9f713'
+down_revision = 'a3c7e19d0b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('api_key',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=128), nullable=False),
+    sa.Column('prefix', sa.String(length=8), nullable=False),
+    sa.Column('token_hash', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token_hash')
+    )
+    op.create_index(op.f('ix_api_key_user_id'), 'api_key', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_api_key_user_id'), table_name='api_key')
+    op.drop_table('api_key')
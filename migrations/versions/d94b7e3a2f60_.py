@@ -0,0 +1,23 @@
+"""Add index on alternate_instrument_name.name
+
+Revision ID: d94b7e3a2f60
+Revises: c6e2d4a9f713
+Create Date: 2026-10-18 20:02:14.530981
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd94b7e3a2f60'
+down_revision = 'c6e2d4a9f713'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_alternate_instrument_name_name'), 'alternate_instrument_name', ['name'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_alternate_instrument_name_name'), table_name='alternate_instrument_name')
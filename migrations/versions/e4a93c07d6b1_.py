@@ -0,0 +1,26 @@
+"""Add instrument image_pending column
+
+Revision ID: e4a93c07d6b1
+Revises: b71f0d9c4e25
+Create Date: 2026-10-18 16:20:48.774930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a93c07d6b1'
+down_revision = 'b71f0d9c4e25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('instrument') as batch_op:
+        batch_op.add_column(sa.Column('image_pending', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table('instrument') as batch_op:
+        batch_op.drop_column('image_pending')
@@ -0,0 +1,30 @@
+"""Add deleted_instrument table
+
+Revision ID: f3b8e15a7c92
+Revises: 7a1f5c3e8b24
+Create Date: 2026-10-18 22:14:36.502917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8e15a7c92'
+down_revision = '7a1f5c3e8b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('deleted_instrument',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_deleted_instrument_deleted_at'), 'deleted_instrument', ['deleted_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_deleted_instrument_deleted_at'), table_name='deleted_instrument')
+    op.drop_table('deleted_instrument')
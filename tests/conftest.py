@@ -0,0 +1,177 @@
+"""
+Fixtures shared by the tests.
+
+The app reads its settings from the environment when it's imported, so
+the database is pointed at a temporary SQLite file before that happens.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import shutil
+from socketserver import ThreadingMixIn
+import tempfile
+from threading import Lock, Thread
+import time
+import pytest
+
+database_dir = tempfile.mkdtemp(prefix='instrument-catalog-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(database_dir,
+                                                         'app.db')
+os.environ.pop('CACHE_DIR', None)
+os.environ.pop('DATABASE_REPLICA_URLS', None)
+
+
+@pytest.fixture(scope='session')
+def app():
+    """Return the app, with a database holding the seed data."""
+    from instrument_catalog import app, rate_limiter, search, startup
+    from instrument_catalog.models import db
+
+    app.config['TESTING'] = True
+    rate_limiter.enabled = False
+
+    with app.app_context():
+        db.create_all()
+        search.create_index(db.engine)
+        startup.seed_database()
+
+    yield app
+
+    # Save API key uses now, rather than when the database is gone
+    from instrument_catalog import background
+    background.write_remaining_api_key_uses()
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+    shutil.rmtree(database_dir, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def api_headers(app):
+    """Return headers authenticating API requests as the first user."""
+    from instrument_catalog.auth import create_api_key
+
+    with app.app_context():
+        _, token = create_api_key(1, 'tests')
+
+    return {'Authorization': 'Bearer ' + token}
+
+
+@pytest.fixture
+def client(app):
+    """Return a test client whose requests came through an HTTPS proxy.
+
+    Otherwise, each request would be redirected to HTTPS.
+    """
+    client = app.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    return client
+
+
+@pytest.fixture
+def statements(app):
+    """Return a list which collects the SQL run by the primary database.
+
+    Each item is a (statement, parameters, executemany) tuple.  The list
+    can be cleared to collect only what a later step runs.
+    """
+    from sqlalchemy import event
+    from instrument_catalog.models import db
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements.append((statement, parameters, executemany))
+
+    with app.app_context():
+        engine = db.engine
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.fixture
+def user_client(app, client):
+    """Return a test client logged in as the first user."""
+    # Logging in without OAuth is only possible in development
+    env = app.config['ENV']
+    app.config['ENV'] = 'development'
+
+    try:
+        assert client.post('/login').status_code == 303
+    finally:
+        app.config['ENV'] = env
+
+    return client
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    """Answer image checks with a small PNG, unless the path says otherwise.
+
+    Paths starting with /missing get a 404 response, and paths starting
+    with /slow are answered after the server's `delay`.
+    """
+    def do_HEAD(self):
+        server = self.server
+
+        with server.lock:
+            server.paths.append(self.path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+
+        try:
+            if self.path.startswith('/slow'):
+                time.sleep(server.delay)
+
+            if self.path.startswith('/missing'):
+                self.send_response(404)  # Not Found
+                self.send_header('Content-Type', 'text/html')
+            else:
+                self.send_response(200)  # OK
+                self.send_header('Content-Type', 'image/png')
+
+            self.send_header('Content-Length', '1024')
+            self.end_headers()
+        except ConnectionError:
+            pass  # The client stopped waiting
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass  # Keep test output quiet
+
+
+class ImageServer(ThreadingMixIn, HTTPServer):
+    """A local HTTP server standing in for image hosts.
+
+    It records the path of each request and the most requests it was
+    handling at once.
+    """
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ImageRequestHandler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server_port)
+        self.lock = Lock()
+        self.paths = []
+        self.active = 0
+        self.max_active = 0
+        self.delay = 0.5
+
+
+@pytest.fixture
+def image_server():
+    """Return a running `ImageServer`, with no image checks cached."""
+    from instrument_catalog.validation import image_url_cache
+    image_url_cache.clear()
+
+    server = ImageServer()
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,129 @@
+"""
+Checks that alternate names are replaced with as few writes as possible,
+without ever conflicting on the `unique_instrument_index` constraint.
+"""
+import pytest
+from instrument_catalog.models import db, Instrument
+from instrument_catalog.validation import MAX_ALTERNATE_NAMES
+
+TABLE = 'alternate_instrument_name'
+
+
+@pytest.fixture
+def instrument_id(app):
+    """Return the ID of a new instrument, deleted after the test."""
+    with app.app_context():
+        instrument = Instrument(
+            name='Alternate Names Test', user_id=1, category_id=1,
+            description='Made by the alternate names tests.')
+        db.session.add(instrument)
+        db.session.commit()
+        instrument_id = instrument.id
+
+    yield instrument_id
+
+    with app.app_context():
+        db.session.delete(Instrument.query.get(instrument_id))
+        db.session.commit()
+
+
+def set_names(app, instrument_id, names, commit=True):
+    with app.app_context():
+        Instrument.query.get(instrument_id).set_alternate_names(names)
+
+        if commit:
+            db.session.commit()
+
+
+def saved_names(app, instrument_id):
+    """Return the names and indexes in the database, in display order."""
+    with app.app_context():
+        instrument = Instrument.query.get(instrument_id)
+        return [(alt.index, alt.name) for alt in instrument.alternate_names]
+
+
+def rows_written(statements):
+    """Return the number of rows each kind of statement wrote to the table."""
+    rows = {}
+
+    for statement, parameters, executemany in statements:
+        for kind in ('INSERT INTO', 'UPDATE', 'DELETE FROM'):
+            if statement.startswith('{} {} '.format(kind, TABLE)):
+                kind = kind.split()[0]
+                rows[kind] = rows.get(kind, 0) + (len(parameters)
+                                                  if executemany else 1)
+
+    return rows
+
+
+@pytest.mark.parametrize('old, new, writes', [
+    (['A', 'B', 'C'], ['A', 'B', 'C'], {}),  # Unchanged
+    # Moved through a temporary index, since each position was held
+    (['A', 'B', 'C'], ['C', 'A', 'B'], {'UPDATE': 6}),
+    (['A', 'B'], ['B', 'A'], {'UPDATE': 4}),
+    (['A', 'B', 'C'], ['A', 'C'], {'DELETE': 1, 'UPDATE': 2}),
+    (['A', 'B', 'C'], ['B', 'C', 'D'], {'DELETE': 1, 'UPDATE': 4,
+                                        'INSERT': 1}),
+    # Moved straight to a position which no row held
+    (['A', 'B'], ['C', 'D', 'A'], {'UPDATE': 2, 'INSERT': 1}),
+    # Renamed in place
+    (['A', 'B', 'C'], ['A', 'D', 'C'], {'UPDATE': 1}),
+    (['A', 'B', 'C'], ['D', 'B'], {'UPDATE': 1, 'DELETE': 1}),
+    (['A', 'B'], ['A', 'B', 'C'], {'INSERT': 1}),
+    (['A', 'B'], [], {'DELETE': 2}),
+])
+def test_only_changed_rows_are_written(app, instrument_id, statements, old,
+                                       new, writes):
+    set_names(app, instrument_id, old)
+    del statements[:]
+
+    set_names(app, instrument_id, new)
+
+    assert rows_written(statements) == writes
+    assert saved_names(app, instrument_id) == list(enumerate(new))
+
+
+def test_rotated_names_keep_unique_indexes(app, instrument_id):
+    names = ['A', 'B', 'C', 'D', 'E']
+    set_names(app, instrument_id, names)
+
+    for _ in range(len(names)):
+        # Every name moves to a position held by another
+        names = names[1:] + names[:1]
+        set_names(app, instrument_id, names)
+        assert saved_names(app, instrument_id) == list(enumerate(names))
+
+
+def test_edit_is_part_of_one_transaction(app, instrument_id):
+    set_names(app, instrument_id, ['A', 'B', 'C'])
+    set_names(app, instrument_id, ['C', 'D', 'A'], commit=False)
+
+    # Flushed, but rolled back when the app context ends
+    assert saved_names(app, instrument_id) == [(0, 'A'), (1, 'B'), (2, 'C')]
+
+
+def test_hundreds_of_names_are_saved(app, instrument_id):
+    names = ['Name {:03}'.format(number)
+             for number in range(MAX_ALTERNATE_NAMES + 100)]
+    set_names(app, instrument_id, names)
+    assert saved_names(app, instrument_id) == list(enumerate(names))
+
+    names.reverse()
+    set_names(app, instrument_id, names)
+    assert saved_names(app, instrument_id) == list(enumerate(names))
+
+
+def test_too_many_names_are_rejected(client, api_headers, instrument_id):
+    url = '/api/instruments/{}/'.format(instrument_id)
+    names = ['Name {}'.format(number)
+             for number in range(MAX_ALTERNATE_NAMES + 1)]
+    response = client.put(url, headers=api_headers,
+                          json={'alternate_names': names})
+
+    assert response.status_code == 400
+    assert str(MAX_ALTERNATE_NAMES) in response.get_json()['errors'][0]
+
+    response = client.put(url, headers=api_headers,
+                          json={'alternate_names': names[1:]})
+    assert response.status_code == 200
+    assert response.get_json()['data']['alternate_names'] == names[1:]
@@ -0,0 +1,120 @@
+"""
+Checks API key authentication, revocation and last-used times.
+"""
+import time
+import pytest
+from instrument_catalog import auth, background
+from instrument_catalog.auth import create_api_key
+from instrument_catalog.cache import StateCache
+from instrument_catalog.models import db, ApiKey
+
+INSTRUMENT_URL = '/api/instruments/1/'
+
+
+@pytest.fixture
+def api_key(app):
+    """Return the ID of a new API key, and headers which use it."""
+    with app.app_context():
+        api_key, token = create_api_key(1, 'api key tests')
+        return api_key.id, {'Authorization': 'Bearer ' + token}
+
+
+def token_hash(headers):
+    return ApiKey.hash_token(headers['Authorization'][len('Bearer '):])
+
+
+def get_last_used_at(app, api_key_id):
+    with app.app_context():
+        return db.session.query(ApiKey.last_used_at)\
+            .filter_by(id=api_key_id).scalar()
+
+
+@pytest.mark.parametrize('headers', [
+    {'Authorization': 'Bearer not-a-real-key'},
+    {'Authorization': 'Bearer '},
+    {'Authorization': 'Basic dXNlcjpwYXNz'},
+    {},
+])
+def test_unknown_key_is_rejected(client, headers):
+    response = client.get(INSTRUMENT_URL, headers=headers)
+    assert response.status_code == 403
+    assert 'Authorization: Bearer' in response.get_json()['errors'][0]
+
+    if headers.get('Authorization', '').startswith('Bearer '):
+        # Not cached, so unknown keys can't crowd out real ones
+        assert auth.principal_cache.get(
+            'api-key:' + token_hash(headers)) is None
+
+
+def test_revoked_key_stops_working(client, api_headers, api_key):
+    api_key_id, headers = api_key
+    assert client.get(INSTRUMENT_URL, headers=headers).status_code == 200
+    assert auth.principal_cache.get('api-key:' + token_hash(headers))
+
+    response = client.delete('/api/keys/{}/'.format(api_key_id),
+                             headers=api_headers)
+    assert response.status_code == 200
+
+    assert client.get(INSTRUMENT_URL, headers=headers).status_code == 403
+
+
+def test_revoked_key_stops_working_in_other_processes(
+        app, client, api_headers, api_key, tmp_path, monkeypatch):
+    api_key_id, headers = api_key
+    # Each stands in for the principal cache of a different process
+    this_process, other_process = (StateCache(str(tmp_path))
+                                   for _ in range(2))
+
+    monkeypatch.setattr(auth, 'principal_cache', other_process)
+    assert client.get(INSTRUMENT_URL, headers=headers).status_code == 200
+
+    monkeypatch.setattr(auth, 'principal_cache', this_process)
+    assert this_process.get('api-key:' + token_hash(headers))  # Shared
+    response = client.delete('/api/keys/{}/'.format(api_key_id),
+                             headers=api_headers)
+    assert response.status_code == 200
+
+    monkeypatch.setattr(auth, 'principal_cache', other_process)
+    assert client.get(INSTRUMENT_URL, headers=headers).status_code == 403
+
+
+def test_uses_are_written_together(app, client, statements):
+    background.write_api_key_uses(app)  # Anything left by earlier tests
+    keys = []
+
+    for number in range(3):
+        with app.app_context():
+            api_key, token = create_api_key(1, 'batch {}'.format(number))
+            keys.append(api_key.id)
+
+        response = client.get(INSTRUMENT_URL,
+                              headers={'Authorization': 'Bearer ' + token})
+        assert response.status_code == 200
+
+    # Written later, rather than during each request
+    assert [get_last_used_at(app, key_id) for key_id in keys] == [None] * 3
+
+    del statements[:]
+    background.write_api_key_uses(app)
+
+    updates = [(parameters, executemany)
+               for statement, parameters, executemany in statements
+               if statement.startswith('UPDATE api_key ')]
+    assert len(updates) == 1
+    assert updates[0][1] and len(updates[0][0]) == 3
+    assert all(get_last_used_at(app, key_id) for key_id in keys)
+
+
+def test_use_is_eventually_written(app, client, api_key, monkeypatch):
+    api_key_id, headers = api_key
+    background.write_api_key_uses(app)  # So the next use starts a timer
+    monkeypatch.setattr(background, 'API_KEY_USE_INTERVAL', 0.1)
+
+    assert client.get(INSTRUMENT_URL, headers=headers).status_code == 200
+    deadline = time.monotonic() + 5
+
+    while get_last_used_at(app, api_key_id) is None:
+        assert time.monotonic() < deadline, 'The use was never written'
+        time.sleep(0.05)
+
+    assert background.api_key_uses_timer is None
@@ -0,0 +1,155 @@
+"""
+Checks name suggestions and how every process keeps them current.
+"""
+from threading import Thread
+import pytest
+from instrument_catalog.autocomplete import PrefixIndex, name_snapshot
+from instrument_catalog.cache import IncrementalSnapshot, StateCache
+
+
+@pytest.fixture
+def index():
+    return PrefixIndex({
+        1: ['Harp', 'Pedal Harp'],
+        2: ['Harp Guitar'],
+        3: ['Harmonica', 'Blues Harp'],
+        4: ['harpsichord'],
+        5: ['Zither', 'Zither Harp'],
+    })
+
+
+def suggested(index, prefix, limit=10):
+    return [(suggestion['id'], suggestion['name'])
+            for suggestion in index.suggest(prefix, limit)]
+
+
+def test_suggestions_are_in_alphabetical_order(index):
+    # "Harp" comes before "Harp Guitar", even though its ID is larger
+    assert suggested(index, 'har') == [
+        (3, 'Harmonica'), (1, 'Harp'), (2, 'Harp Guitar'), (4, 'harpsichord')]
+    assert suggested(index, 'har', limit=2) == [(3, 'Harmonica'), (1, 'Harp')]
+
+
+def test_suggestions_ignore_case_and_spaces(index):
+    assert suggested(index, '  HARP   g') == [(2, 'Harp Guitar')]
+    assert suggested(index, 'pedal') == [(1, 'Pedal Harp')]
+    assert suggested(index, '   ') == []
+
+
+def test_instruments_are_suggested_once(index):
+    assert index.suggest('zither', 10) == [
+        {'id': 5, 'name': 'Zither', 'instrument_name': 'Zither'}]
+    assert index.suggest('blues', 10) == [
+        {'id': 3, 'name': 'Blues Harp', 'instrument_name': 'Harmonica'}]
+
+
+def test_index_updates_in_place(index):
+    index.update(2, ['Bass Guitar'])  # Renamed
+    index.update(4, [])  # Deleted
+    index.update(6, ['Harpoon'])  # Added
+
+    assert suggested(index, 'harp') == [(1, 'Harp'), (6, 'Harpoon')]
+    assert suggested(index, 'bass') == [(2, 'Bass Guitar')]
+    assert len(index) == 8
+
+
+class Process(object):
+    """Stands in for a worker process with its own copy of a snapshot."""
+    def __init__(self, cache_dir, data):
+        self.loads = 0
+        self.data = data
+        self.snapshot = IncrementalSnapshot(
+            'test', self.load, self.update, store=StateCache(cache_dir))
+
+    def load(self):
+        self.loads += 1
+        return dict(self.data)
+
+    def update(self, value, keys):
+        for key in keys:
+            value[key] = self.data.get(key)
+
+
+def test_recorded_changes_reach_other_processes(tmp_path):
+    data = {'a': 1, 'b': 2}
+    writer, reader = (Process(str(tmp_path), data) for _ in range(2))
+    assert reader.snapshot.get() == {'a': 1, 'b': 2}
+
+    data.update(a=10, c=3)
+    writer.snapshot.record(['a', 'c'])
+
+    assert reader.snapshot.get() == {'a': 10, 'b': 2, 'c': 3}
+    assert reader.loads == 1  # Updated in place
+
+
+def test_concurrent_records_are_all_kept(tmp_path):
+    data = {}
+    reader = Process(str(tmp_path), data)
+    reader.snapshot.get()
+    writers = [Process(str(tmp_path), data) for _ in range(8)]
+
+    def record_changes(writer, number):
+        for change in range(20):
+            key = '{}-{}'.format(number, change)
+            data[key] = True
+            writer.snapshot.record([key])
+
+    threads = [Thread(target=record_changes, args=(writer, number))
+               for number, writer in enumerate(writers)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(reader.snapshot.get()) == 8 * 20
+    assert reader.loads == 1
+
+
+def test_expired_records_cause_a_reload(tmp_path):
+    data = {'a': 1}
+    writer, reader = (Process(str(tmp_path), data) for _ in range(2))
+    reader.snapshot.get()
+
+    writer.snapshot.log_timeout = -1  # Expired as soon as it's stored
+    data['a'] = 10
+    writer.snapshot.record(['a'])
+
+    assert reader.snapshot.get() == {'a': 10}
+    assert reader.loads == 2
+
+
+def get_suggestions(client, api_headers, prefix):
+    response = client.get('/api/autocomplete', headers=api_headers,
+                          query_string={'prefix': prefix})
+    assert response.status_code == 200
+    return [(suggestion['id'], suggestion['name'])
+            for suggestion in response.get_json()['data']]
+
+
+def test_name_changes_are_applied_in_place(client, api_headers, monkeypatch):
+    get_suggestions(client, api_headers, 'ocarina')  # Loads the names
+    monkeypatch.setattr(name_snapshot, 'loader', None)  # Can't be reloaded
+
+    response = client.post('/api/instruments/', headers=api_headers, json={
+        'name': 'Ocarina', 'description': 'Added by the autocomplete tests.',
+        'category_id': 1, 'alternate_names': ['Vessel Flute']})
+    assert response.status_code == 201
+    instrument_id = response.get_json()['data']['id']
+    assert get_suggestions(client, api_headers, 'ocarina') == \
+        [(instrument_id, 'Ocarina')]
+    assert get_suggestions(client, api_headers, 'vessel') == \
+        [(instrument_id, 'Vessel Flute')]
+
+    url = '/api/instruments/{}/'.format(instrument_id)
+    response = client.put(url, headers=api_headers,
+                          json={'name': 'Pendant Ocarina'})
+    assert response.status_code == 200
+    assert get_suggestions(client, api_headers, 'ocarina') == []
+    assert get_suggestions(client, api_headers, 'pendant') == \
+        [(instrument_id, 'Pendant Ocarina')]
+
+    assert client.delete(url, headers=api_headers).status_code == 200
+    assert get_suggestions(client, api_headers, 'pendant') == []
+    assert get_suggestions(client, api_headers, 'vessel') == []
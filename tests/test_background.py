@@ -0,0 +1,62 @@
+"""
+Checks that images saved without waiting are checked in the background.
+"""
+import time
+import pytest
+from instrument_catalog.models import Instrument
+
+
+@pytest.fixture
+def async_images(app, monkeypatch):
+    """Save instruments before checking their image URLs."""
+    monkeypatch.setitem(app.config, 'ASYNC_IMAGE_VALIDATION', True)
+
+
+def get_image(app, instrument_id):
+    """Return an instrument's image URL and whether it is pending."""
+    with app.app_context():
+        instrument = Instrument.query.get(instrument_id)
+        return instrument.image, instrument.image_pending
+
+
+def wait_for_image_check(app, instrument_id, timeout=5):
+    """Return `get_image()` once the check is done, or after `timeout`."""
+    deadline = time.monotonic() + timeout
+    image, pending = get_image(app, instrument_id)
+
+    while pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+        image, pending = get_image(app, instrument_id)
+
+    return image, pending
+
+
+def create_instrument_with_form(client, image):
+    """Submit the new instrument form and return the new instrument's ID."""
+    response = client.post('/instruments/new', data={
+        'name': 'Checked Later',
+        'description': 'Its image is checked after saving.',
+        'category_id': '1',
+        'image': image
+    })
+    assert response.status_code == 303
+    return int(response.headers['Location'].rstrip('/').rsplit('/', 1)[1])
+
+
+@pytest.mark.usefixtures('async_images')
+def test_form_image_is_checked_after_saving(app, user_client, image_server):
+    url = image_server.url + '/slow.png'
+    instrument_id = create_instrument_with_form(user_client, url)
+
+    # The image host hasn't answered yet, so the image is still pending
+    assert get_image(app, instrument_id) == (url, True)
+    assert wait_for_image_check(app, instrument_id) == (url, False)
+    assert image_server.paths == ['/slow.png']
+
+
+@pytest.mark.usefixtures('async_images')
+def test_invalid_form_image_is_removed(app, user_client, image_server):
+    url = image_server.url + '/missing.png'
+    instrument_id = create_instrument_with_form(user_client, url)
+
+    assert wait_for_image_check(app, instrument_id) == (None, False)
@@ -0,0 +1,204 @@
+"""
+Checks the batch endpoint, which applies every operation or none of them.
+"""
+import pytest
+from instrument_catalog.api import MAX_BATCH_SIZE
+from instrument_catalog.models import db, Instrument, User, MAX_IDS_PER_QUERY
+
+BATCH_URL = '/api/instruments/batch'
+
+
+def new_instrument_data(name, **data):
+    """Return the fields of a valid instrument with a given name."""
+    return dict({'name': name, 'description': 'Made by the batch tests.',
+                 'category_id': 1}, **data)
+
+
+def add_instruments(app, *names, user_id=1):
+    """Save instruments directly and return their IDs."""
+    with app.app_context():
+        instruments = [Instrument(user_id=user_id, **new_instrument_data(name))
+                       for name in names]
+        db.session.add_all(instruments)
+        db.session.commit()
+        return [instrument.id for instrument in instruments]
+
+
+def get_names(app, instrument_ids):
+    """Return the name of each instrument, or None if it doesn't exist."""
+    with app.app_context():
+        instruments = Instrument.get_many(instrument_ids)
+        return [getattr(instruments.get(instrument_id), 'name', None)
+                for instrument_id in instrument_ids]
+
+
+def count_named(app, name):
+    with app.app_context():
+        return Instrument.query.filter_by(name=name).count()
+
+
+@pytest.fixture
+def other_user_id(app):
+    """Return the ID of a user other than the one making API requests."""
+    with app.app_context():
+        user = User.query.filter_by(name='Batch Tests').first()
+
+        if user is None:
+            user = User(name='Batch Tests')
+            db.session.add(user)
+            db.session.commit()
+
+        return user.id
+
+
+def test_mixed_batch_is_applied(app, client, api_headers):
+    updated_id, deleted_id = add_instruments(app, 'Batch Update', 'Batch Del')
+
+    response = client.post(BATCH_URL, headers=api_headers, json=[
+        {'action': 'create', 'instrument': new_instrument_data(
+            'Batch Create',
+            alternate_names=['Batch Alias 1', 'Batch Alias 2'])},
+        {'action': 'update', 'id': updated_id,
+         'instrument': {'name': 'Batch Updated'}},
+        {'action': 'delete', 'id': deleted_id},
+    ])
+    assert response.status_code == 200
+
+    created, updated, deleted = response.get_json()['data']
+    assert [created['action'], updated['action'], deleted['action']] == \
+        ['create', 'update', 'delete']
+    assert all(result['successful'] for result in (created, updated, deleted))
+    assert created['data']['alternate_names'] == ['Batch Alias 1',
+                                                  'Batch Alias 2']
+    assert updated['data']['name'] == 'Batch Updated'
+    assert deleted['data'] == {'deleted_instrument_id': deleted_id}
+
+    assert get_names(app, [created['data']['id'], updated_id, deleted_id]) \
+        == ['Batch Create', 'Batch Updated', None]
+
+
+def test_batch_size_is_limited(client, api_headers):
+    operations = [{'action': 'delete', 'id': 1}] * (MAX_BATCH_SIZE + 1)
+    response = client.post(BATCH_URL, headers=api_headers, json=operations)
+
+    assert response.status_code == 400
+    assert str(MAX_BATCH_SIZE) in response.get_json()['errors'][0]
+
+
+@pytest.mark.parametrize('operation, error', [
+    ('delete', 'must be "create", "update", or "delete"'),
+    ({'action': 'explode', 'id': 1}, 'must be "create", "update"'),
+    ({'action': 'update', 'id': True, 'instrument': {}}, '`id` must be'),
+    ({'action': 'delete', 'id': '1'}, '`id` must be'),
+    ({'action': 'create', 'instrument': ['Batch Create']},
+     '`instrument` must be an object'),
+    ({'action': 'create', 'instrument': {'name': 'Batch Create'}},
+     'Required data is missing'),
+])
+def test_invalid_operation_cancels_batch(app, client, api_headers, operation,
+                                         error):
+    response = client.post(BATCH_URL, headers=api_headers, json=[
+        {'action': 'create',
+         'instrument': new_instrument_data('Batch Invalid')},
+        operation,
+    ])
+    assert response.status_code == 400
+
+    valid, invalid = response.get_json()['data']
+    assert valid['successful'] and not invalid['successful']
+    assert error in invalid['errors'][0]
+    assert count_named(app, 'Batch Invalid') == 0
+
+
+def test_each_id_is_used_once(app, client, api_headers):
+    instrument_id, = add_instruments(app, 'Batch Twice')
+    response = client.post(BATCH_URL, headers=api_headers, json=[
+        {'action': 'update', 'id': instrument_id, 'instrument': {}},
+        {'action': 'delete', 'id': instrument_id},
+    ])
+    assert response.status_code == 400
+    assert 'only be used once' in \
+        response.get_json()['data'][1]['errors'][0]
+
+
+def test_other_users_instrument_is_rejected(app, client, api_headers,
+                                            other_user_id):
+    theirs, = add_instruments(app, 'Batch Theirs', user_id=other_user_id)
+    response = client.post(BATCH_URL, headers=api_headers, json=[
+        {'action': 'create', 'instrument': new_instrument_data('Batch Mine')},
+        {'action': 'delete', 'id': theirs},
+    ])
+    assert response.status_code == 400
+    assert 'authenticate as the user' in \
+        response.get_json()['data'][1]['errors'][0]
+    assert get_names(app, [theirs]) == ['Batch Theirs']
+    assert count_named(app, 'Batch Mine') == 0
+
+
+def test_conflicting_batch_is_rolled_back(app, client, api_headers,
+                                          monkeypatch):
+    updated_id, taken_id = add_instruments(app, 'Batch Before', 'Batch Taken')
+    # As if another writer had used the ID reserved for the new instrument
+    monkeypatch.setattr(Instrument, 'reserve_ids', lambda count: [taken_id])
+
+    response = client.post(BATCH_URL, headers=api_headers, json=[
+        {'action': 'update', 'id': updated_id,
+         'instrument': {'name': 'Batch After'}},
+        {'action': 'create',
+         'instrument': new_instrument_data('Batch Conflict')},
+    ])
+    assert response.status_code == 409
+    assert get_names(app, [updated_id, taken_id]) == ['Batch Before',
+                                                      'Batch Taken']
+    assert count_named(app, 'Batch Conflict') == 0
+
+
+def test_targets_are_loaded_in_batches(app, client, api_headers,
+                                       statements):
+    names = ['Batch Many {}'.format(number)
+             for number in range(MAX_IDS_PER_QUERY + 100)]
+    instrument_ids = add_instruments(app, *names)
+
+    del statements[:]
+    response = client.post(BATCH_URL, headers=api_headers, json=[
+        {'action': 'update', 'id': instrument_id,
+         'instrument': {'description': 'Updated by the batch tests.'}}
+        for instrument_id in instrument_ids
+    ])
+    assert response.status_code == 200
+
+    target_queries = [parameters for statement, parameters, _ in statements
+                      if statement.startswith('SELECT instrument.')
+                      and 'WHERE instrument.id IN' in statement]
+    assert len(target_queries) == 2
+    assert all(len(parameters) <= MAX_IDS_PER_QUERY
+               for parameters in target_queries)
+
+
+def test_creates_with_reserved_ids_are_inserted_together(
+        app, client, api_headers, statements, monkeypatch):
+    # As PostgreSQL does with a sequence, reserve IDs before inserting
+    def reserve_ids(count):
+        start = db.session.query(db.func.max(Instrument.id)).scalar() + 1
+        return list(range(start, start + count))
+
+    monkeypatch.setattr(Instrument, 'reserve_ids', reserve_ids)
+
+    del statements[:]
+    response = client.post(BATCH_URL, headers=api_headers, json=[
+        {'action': 'create', 'instrument': new_instrument_data(
+            'Batch Bulk {}'.format(number),
+            alternate_names=['Batch Bulk Alias {}'.format(number)])}
+        for number in range(3)
+    ])
+    assert response.status_code == 200
+
+    inserts = [executemany for statement, _, executemany in statements
+               if statement.startswith('INSERT INTO instrument ')]
+    assert inserts == [True]
+
+    results = response.get_json()['data']
+    created_ids = [result['data']['id'] for result in results]
+    assert created_ids == list(range(created_ids[0], created_ids[0] + 3))
+    assert get_names(app, created_ids) == \
+        ['Batch Bulk 0', 'Batch Bulk 1', 'Batch Bulk 2']
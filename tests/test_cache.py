@@ -0,0 +1,49 @@
+"""
+Checks the caches shared between worker processes.
+"""
+import json
+import os
+import subprocess
+import sys
+from instrument_catalog.cache import StateCache
+
+
+def test_state_cache_only_discards_expired_items(tmp_path):
+    cache = StateCache(str(tmp_path), threshold=10, prune_interval=0)
+
+    for number in range(5):
+        cache.set('expired-{}'.format(number), number, timeout=-1)
+
+    for number in range(10):
+        cache.set('current-{}'.format(number), number, timeout=0)
+
+    for number in range(10):
+        assert cache.get('current-{}'.format(number)) == number
+
+    assert len(os.listdir(str(tmp_path))) == 10 + 1  # And werkzeug's counter
+
+
+def test_rendered_output_is_kept_apart_from_state(tmp_path):
+    code = '\n'.join([
+        'import json',
+        'from instrument_catalog import auth, routing, rendering',
+        'from instrument_catalog.autocomplete import name_snapshot',
+        'from instrument_catalog.cache import StateCache',
+        'from instrument_catalog.models import category_snapshot',
+        'state = routing.recent_writers',
+        'print(json.dumps([',
+        '    isinstance(state, StateCache),',
+        '    auth.principal_cache is state,',
+        '    category_snapshot.store is state,',
+        '    name_snapshot.store is state,',
+        '    isinstance(rendering.render_cache.backend, StateCache),',
+        ']))',
+    ])
+    env = dict(os.environ, CACHE_DIR=str(tmp_path))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                     cwd=root)
+
+    assert json.loads(output.decode('utf-8').splitlines()[-1]) == \
+        [True, True, True, True, False]
+    assert sorted(os.listdir(str(tmp_path))) == ['rendered', 'state']
@@ -0,0 +1,119 @@
+"""
+Checks the streamed NDJSON export, with and without gzip.
+"""
+from datetime import datetime
+import gzip
+import json
+from instrument_catalog.api import iter_gzip_chunks, iter_ndjson_chunks
+from instrument_catalog.models import db, Instrument
+
+
+def create_instrument(client, api_headers, name):
+    response = client.post('/api/instruments/', headers=api_headers, json={
+        'name': name, 'description': 'Made by the export tests.',
+        'category_id': 1})
+    assert response.status_code == 201
+    return response.get_json()['data']['id']
+
+
+def instrument_url(instrument_id):
+    return '/api/instruments/{}/'.format(instrument_id)
+
+
+def get_export(client, api_headers, url='/api/export.ndjson', **query_string):
+    """Return the lines of an export, parsed from JSON."""
+    response = client.get(url, headers=api_headers, query_string=query_string)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.data.splitlines()]
+
+
+def now():
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def test_export_lists_every_instrument(app, client, api_headers):
+    deleted_id = create_instrument(client, api_headers, 'Export Deleted')
+    client.delete(instrument_url(deleted_id), headers=api_headers)
+    lines = get_export(client, api_headers)
+
+    with app.app_context():
+        expected = [instrument.serialize() for instrument
+                    in Instrument.query.order_by(Instrument.id)]
+
+    # Deletions aren't listed, since every instrument is
+    assert [dict(line, updated_at=None) for line in lines] == \
+        [dict(instrument, updated_at=None) for instrument in expected]
+    assert all(line['updated_at'].endswith('Z') for line in lines)
+
+
+def test_gzip_export_holds_the_same_data(client, api_headers):
+    plain = client.get('/api/export.ndjson', headers=api_headers)
+    compressed = client.get('/api/export.ndjson.gz', headers=api_headers)
+
+    assert compressed.status_code == 200
+    assert compressed.mimetype == 'application/gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+
+
+def test_recent_export_lists_changes_and_deletions(client, api_headers):
+    # Not deleting the newest, whose ID SQLite would reuse
+    deleted_id, unchanged_id, updated_id = (
+        create_instrument(client, api_headers, 'Export ' + name)
+        for name in ('Deleted', 'Unchanged', 'Updated'))
+    since = now()
+
+    response = client.put(instrument_url(updated_id), headers=api_headers,
+                          json={'name': 'Export Updated Again'})
+    assert response.status_code == 200
+    assert client.delete(instrument_url(deleted_id),
+                         headers=api_headers).status_code == 200
+    created_id = create_instrument(client, api_headers, 'Export Created')
+
+    lines = get_export(client, api_headers, updated_since=since)
+    changed, deleted = lines[:-1], dict(lines[-1])
+
+    assert [(line['id'], line['name']) for line in changed] == \
+        [(updated_id, 'Export Updated Again'), (created_id, 'Export Created')]
+    assert deleted.pop('updated_at') >= since
+    assert deleted == {'id': deleted_id, 'deleted': True}
+
+    # The same lines, compressed
+    response = client.get('/api/export.ndjson.gz', headers=api_headers,
+                          query_string={'updated_since': since})
+    assert [json.loads(line) for line
+            in gzip.decompress(response.data).splitlines()] == lines
+
+
+def test_reused_id_is_not_listed_as_deleted(app, client, api_headers):
+    since = now()
+    instrument_id = create_instrument(client, api_headers, 'Export Reused')
+    client.delete(instrument_url(instrument_id), headers=api_headers)
+
+    with app.app_context():
+        # As SQLite does when the largest ID is deleted
+        db.session.add(Instrument(id=instrument_id, name='Export Reuser',
+                                  description='Made by the export tests.',
+                                  user_id=1, category_id=1))
+        db.session.commit()
+
+    lines = get_export(client, api_headers, updated_since=since)
+    assert [(line['id'], line.get('name')) for line in lines] == \
+        [(instrument_id, 'Export Reuser')]
+
+
+def test_invalid_timestamp_is_rejected(client, api_headers):
+    response = client.get('/api/export.ndjson', headers=api_headers,
+                          query_string={'updated_since': 'yesterday'})
+    assert response.status_code == 400
+
+
+def test_lines_are_grouped_into_chunks(app):
+    with app.app_context():
+        expected = b''.join(iter_ndjson_chunks())
+        chunks = list(iter_ndjson_chunks(lines_per_chunk=2))
+
+    assert len(chunks) > 1
+    assert all(chunk.count(b'\n') <= 2 for chunk in chunks)
+    assert b''.join(chunks) == expected
+    assert gzip.decompress(b''.join(iter_gzip_chunks(chunks))) == expected
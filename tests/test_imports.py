@@ -0,0 +1,56 @@
+"""
+Checks how long importing the app takes, using `python -X importtime`.
+
+Every worker process imports the app before serving its first request,
+so slow imports which most requests don't use are done lazily.
+"""
+import os
+import subprocess
+import sys
+import pytest
+
+# Only needed for `flask db` commands and for highlighting code samples
+LAZY_MODULES = ['alembic', 'flask_migrate', 'pygments']
+
+# Seconds that the app's own modules may spend running when imported, not
+# counting the packages they import.  They take well under a tenth of this,
+# so going over means that something slow is done at import time.
+IMPORT_TIME_BUDGET = 0.5
+
+
+@pytest.fixture(scope='module')
+def import_times():
+    """Return the self and cumulative seconds for each imported module."""
+    # A new interpreter, since these tests have already imported the app
+    env = dict(os.environ)
+    env.pop('FLASK_RUN_FROM_CLI', None)  # Set by the `flask` command
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-X', 'importtime',
+               '-c', 'import instrument_catalog']
+    process = subprocess.run(command, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, env=env, cwd=root,
+                             check=True)
+
+    # After the header, lines look like
+    # "import time: <self us> | <cumulative us> | <module>"
+    times = {}
+
+    for line in process.stderr.decode('utf-8').splitlines():
+        if line.startswith('import time:') and '[us]' not in line:
+            self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+            times[name.strip()] = (int(self_us) / 1e6,
+                                   int(cumulative_us) / 1e6)
+
+    assert 'instrument_catalog' in times
+    return times
+
+
+def test_import_leaves_out_lazy_modules(import_times):
+    imported = {name.split('.')[0] for name in import_times}
+    assert [name for name in LAZY_MODULES if name in imported] == []
+
+
+def test_app_modules_import_quickly(import_times):
+    app_time = sum(self_time for name, (self_time, _) in import_times.items()
+                   if name.split('.')[0] == 'instrument_catalog')
+    assert app_time < IMPORT_TIME_BUDGET
@@ -0,0 +1,166 @@
+"""
+Checks keyset pagination of instrument lists.
+"""
+import base64
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from instrument_catalog.api import MAX_PAGE_SIZE
+from instrument_catalog.models import db, Category, Instrument
+
+
+def add_category(app, name, instrument_names):
+    """Save a category holding instruments with the given names.
+
+    Returns:
+        tuple[int, list]: The category ID and the instrument IDs.
+    """
+    with app.app_context():
+        category = Category(name=name, description='Made by the tests.')
+        instruments = [Instrument(name=instrument_name, user_id=1,
+                                  category=category,
+                                  description='Made by the pagination tests.')
+                       for instrument_name in instrument_names]
+        db.session.add_all(instruments)
+        db.session.commit()
+        return category.id, [instrument.id for instrument in instruments]
+
+
+def delete_category(app, category_id):
+    with app.app_context():
+        for instrument in Instrument.query.filter_by(category_id=category_id):
+            db.session.delete(instrument)
+
+        db.session.delete(Category.query.get(category_id))
+        db.session.commit()
+
+
+@pytest.fixture(scope='module')
+def tied_category(app):
+    """Return a category ID, and its instrument IDs in listing order.
+
+    Most instruments share their name with others, so pages end in the
+    middle of a group of ties.
+    """
+    names = ['Tied {}'.format('BCA'[number % 3]) for number in range(11)]
+    category_id, instrument_ids = add_category(app, 'Pagination Ties', names)
+    yield category_id, [instrument_id for _, instrument_id
+                        in sorted(zip(names, instrument_ids))]
+    delete_category(app, category_id)
+
+
+@pytest.fixture(scope='module')
+def large_category(app):
+    """Return the ID of a category holding more than a page of instruments."""
+    names = ['Large {:03}'.format(number)
+             for number in range(MAX_PAGE_SIZE + 1)]
+    category_id, _ = add_category(app, 'Pagination Large', names)
+    yield category_id
+    delete_category(app, category_id)
+
+
+def category_url(category_id):
+    return '/api/categories/{}/instruments/'.format(category_id)
+
+
+def get_page(client, api_headers, url, **query_string):
+    """Return the instrument IDs on a page and the URL of the next page."""
+    response = client.get(url, headers=api_headers, query_string=query_string)
+    assert response.status_code == 200
+    body = response.get_json()
+    return [instrument['id'] for instrument in body['data']], \
+        body['links']['next']
+
+
+def next_page_args(next_url):
+    parts = urlsplit(next_url)
+    return parts.path, {name: values[0] for name, values
+                        in parse_qs(parts.query).items()}
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 4, 5, 10, 11])
+def test_walk_visits_ties_once_in_order(client, api_headers, tied_category,
+                                        limit):
+    category_id, expected_ids = tied_category
+    url, args = category_url(category_id), {'limit': limit}
+    walked = []
+
+    while url is not None:
+        page, next_url = get_page(client, api_headers, url, **args)
+        assert 0 < len(page) <= limit
+        walked.extend(page)
+
+        if next_url is not None:
+            url, args = next_page_args(next_url)
+            assert args['limit'] == str(limit)
+        else:
+            url = None
+
+    assert walked == expected_ids
+
+
+def test_next_is_null_on_last_page(client, api_headers, tied_category):
+    category_id, expected_ids = tied_category
+    url = category_url(category_id)
+
+    # Exactly one page
+    page, next_url = get_page(client, api_headers, url,
+                              limit=len(expected_ids))
+    assert page == expected_ids and next_url is None
+
+    # One more instrument than fits
+    page, next_url = get_page(client, api_headers, url,
+                              limit=len(expected_ids) - 1)
+    assert next_url is not None
+
+    path, args = next_page_args(next_url)
+    page, next_url = get_page(client, api_headers, path, **args)
+    assert page == expected_ids[-1:] and next_url is None
+
+
+def test_limit_is_clamped(client, api_headers, large_category):
+    page, next_url = get_page(client, api_headers,
+                              category_url(large_category),
+                              limit=MAX_PAGE_SIZE * 2)
+    assert len(page) == MAX_PAGE_SIZE
+
+    path, args = next_page_args(next_url)
+    assert args['limit'] == str(MAX_PAGE_SIZE)
+    page, next_url = get_page(client, api_headers, path, **args)
+    assert len(page) == 1 and next_url is None
+
+
+def encode(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    'not a cursor!',
+    'Zm9v=',
+    encode('not JSON'),
+    encode('{"name": "Harp", "id": 1}'),
+    encode('["Harp"]'),
+    encode('["Harp", 1, 2]'),
+    encode('[1, "Harp"]'),
+    encode('["Harp", "1"]'),
+    base64.urlsafe_b64encode(b'["\xff", 1]').decode('ascii'),
+    'cafés',
+])
+def test_malformed_cursor_is_rejected(client, api_headers, cursor):
+    response = client.get('/api/instruments/', headers=api_headers,
+                          query_string={'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == \
+        ['An invalid `cursor` was provided.']
+
+
+@pytest.mark.parametrize('limit, error', [
+    ('ten', '`limit` must be an integer.'),
+    ('0', '`limit` must be at least 1.'),
+    ('-5', '`limit` must be at least 1.'),
+])
+def test_invalid_limit_is_rejected(client, api_headers, limit, error):
+    response = client.get('/api/instruments/', headers=api_headers,
+                          query_string={'limit': limit})
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [error]
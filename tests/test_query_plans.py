@@ -0,0 +1,74 @@
+"""
+Checks that instrument listings are read in order from an index.
+
+Each listing's query is captured while the page is requested, and
+SQLite's `EXPLAIN QUERY PLAN` must show that it walks one of the
+instrument indexes instead of sorting rows in a temporary B-tree.
+"""
+import pytest
+from instrument_catalog.models import db
+
+
+def get_listing_plans(app, client, url, headers, statements):
+    """Request a page and return the plan of each sorted instrument query.
+
+    Returns:
+        tuple[Response, list[str]]: The response, and the details of each
+                                    query plan joined into one string.
+    """
+    del statements[:]
+    response = client.get(url, headers=headers)
+    response.get_data()  # Streamed pages run their queries here
+
+    plans = []
+
+    with app.app_context():
+        for statement, parameters, _ in list(statements):
+            if 'FROM instrument' in statement and 'ORDER BY' in statement:
+                rows = db.engine.execute('EXPLAIN QUERY PLAN ' + statement,
+                                         parameters)
+                plans.append('\n'.join(row[-1] for row in rows))
+
+    return response, plans
+
+
+@pytest.mark.parametrize('url, index', [
+    ('/api/categories/1/instruments/?limit=1',
+     'ix_instrument_category_id_name'),
+    ('/api/myinstruments/?limit=1', 'ix_instrument_user_id_name'),
+    ('/api/instruments/?limit=1', 'ix_instrument_name'),
+])
+def test_api_pages_use_index(app, client, api_headers, statements, url,
+                             index):
+    response, plans = get_listing_plans(app, client, url, api_headers,
+                                        statements)
+    assert response.status_code == 200
+    assert plans
+
+    for plan in plans:
+        assert index in plan
+        assert 'TEMP B-TREE' not in plan
+
+    # Later pages start from a cursor, which must also use the index
+    next_url = response.get_json()['links']['next']
+    assert next_url is not None
+
+    response, plans = get_listing_plans(app, client, next_url, api_headers,
+                                        statements)
+    assert response.status_code == 200
+    assert plans
+
+    for plan in plans:
+        assert index in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+def test_all_instruments_page_uses_index(app, client, statements):
+    response, plans = get_listing_plans(app, client, '/instruments/', {},
+                                        statements)
+    assert response.status_code == 200
+    assert plans
+
+    for plan in plans:
+        assert 'ix_instrument_category_id_name' in plan
+        assert 'TEMP B-TREE' not in plan
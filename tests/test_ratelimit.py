@@ -0,0 +1,134 @@
+"""
+Checks the SQLite rate limit storage shared by every worker process.
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from limits.strategies import MovingWindowRateLimiter
+import pytest
+from instrument_catalog import api, rate_limiter
+from instrument_catalog.ratelimit import SQLiteStorage
+
+
+@pytest.fixture
+def storage_uri(tmp_path):
+    return 'sqlite:///' + str(tmp_path / 'rate-limits.db')
+
+
+@pytest.fixture
+def storage(storage_uri):
+    return SQLiteStorage(storage_uri)
+
+
+def count_rows(storage, table):
+    with sqlite3.connect(storage.path) as connection:
+        return connection.execute(
+            'SELECT count(*) FROM ' + table).fetchone()[0]
+
+
+def test_moving_window_allows_limit_hits(storage):
+    assert storage.acquire_entry('key', 2, 60)
+    assert storage.acquire_entry('key', 2, 60)
+    assert not storage.acquire_entry('key', 2, 60)
+    # Other keys have their own windows
+    assert storage.acquire_entry('other', 2, 60)
+
+    start, count = storage.get_moving_window('key', 2, 60)
+    assert count == 2
+    assert time.time() - 60 <= start <= time.time()
+
+
+def test_moving_window_check_without_hit(storage):
+    assert storage.acquire_entry('key', 1, 60, no_add=True)
+    assert storage.get_moving_window('key', 1, 60)[1] == 0
+    assert storage.acquire_entry('key', 1, 60)
+
+
+def test_hits_expire(storage):
+    assert storage.acquire_entry('key', 1, 0.2)
+    assert not storage.acquire_entry('key', 1, 0.2)
+    assert storage.incr('counter', 0.2) == 1
+    assert storage.incr('counter', 0.2) == 2
+
+    time.sleep(0.25)
+
+    assert storage.get_moving_window('key', 1, 0.2)[1] == 0
+    assert storage.get('counter') == 0
+    assert storage.acquire_entry('key', 1, 0.2)
+    assert storage.incr('counter', 0.2) == 1
+
+
+def test_expired_rows_are_deleted(storage, monkeypatch):
+    storage.acquire_entry('key', 5, 0.1)
+    storage.incr('counter', 0.1)
+    time.sleep(0.15)
+
+    monkeypatch.setattr(storage, 'PRUNE_INTERVAL', 0)
+    storage.acquire_entry('other', 5, 60)
+
+    assert count_rows(storage, 'entry') == 1
+    assert count_rows(storage, 'counter') == 0
+
+
+def test_connections_share_hits(storage_uri):
+    first, second = SQLiteStorage(storage_uri), SQLiteStorage(storage_uri)
+
+    assert first.acquire_entry('key', 3, 60)
+    assert second.acquire_entry('key', 3, 60)
+    assert first.acquire_entry('key', 3, 60)
+    assert not second.acquire_entry('key', 3, 60)
+    assert second.incr('counter', 60) == 1
+    assert first.incr('counter', 60) == 2
+
+
+def test_processes_never_allow_more_than_limit(storage_uri):
+    code = '\n'.join([
+        'import sys',
+        'from instrument_catalog.ratelimit import SQLiteStorage',
+        'storage = SQLiteStorage(sys.argv[1])',
+        'print(sum(storage.acquire_entry("key", 25, 60) for _ in range(20)))',
+    ])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    processes = [
+        subprocess.Popen([sys.executable, '-c', code, storage_uri],
+                         stdout=subprocess.PIPE, cwd=root)
+        for _ in range(4)
+    ]
+    allowed = [int(process.communicate()[0].decode('utf-8').split()[-1])
+               for process in processes]
+
+    assert sum(allowed) == 25
+    assert SQLiteStorage(storage_uri).get_moving_window('key', 25, 60)[1] \
+        == 25
+
+
+@pytest.fixture
+def limited_app(app, storage, monkeypatch):
+    """Enforce API rate limits, counted in SQLite, during the test."""
+    monkeypatch.setattr(rate_limiter, 'enabled', True)
+    monkeypatch.setattr(rate_limiter, '_storage', storage)
+    monkeypatch.setattr(rate_limiter, '_limiter',
+                        MovingWindowRateLimiter(storage))
+    monkeypatch.setitem(api.RATE_LIMIT_TIERS, 'standard', '2/minute')
+    return app
+
+
+def test_not_modified_responses_are_not_counted(limited_app, client,
+                                                api_headers):
+    url = '/api/instruments/1/'
+    response = client.get(url, headers=api_headers)
+    assert response.status_code == 200
+    assert response.headers['X-RateLimit-Remaining'] == '1'
+
+    conditional_headers = dict(api_headers,
+                               **{'If-None-Match': response.headers['ETag']})
+
+    for _ in range(3):
+        assert client.get(url, headers=conditional_headers).status_code == 304
+
+    response = client.get(url, headers=api_headers)
+    assert response.status_code == 200
+    assert response.headers['X-RateLimit-Remaining'] == '0'
+    assert client.get(url, headers=api_headers).status_code == 429
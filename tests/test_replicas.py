@@ -0,0 +1,90 @@
+"""
+Checks that clients read their own writes while replicas lag behind.
+
+The replica is a copy of the SQLite database file, made before the
+changes in each test, so it never sees them.
+"""
+import os
+import shutil
+import pytest
+from instrument_catalog import routing
+from instrument_catalog.auth import create_api_key
+from instrument_catalog.models import db
+
+INSTRUMENT_URL = '/api/instruments/1/'
+
+
+@pytest.fixture
+def replica(app, monkeypatch):
+    """Add a replica holding the database as it is now.
+
+    Returns:
+        tuple[dict, dict]: Headers authenticating two API clients.
+    """
+    with app.app_context():
+        db.session.remove()
+        primary = db.engine.url.database
+        writer = create_api_key(1, 'replica writer')[1]
+        reader = create_api_key(1, 'replica reader')[1]
+
+    replica_path = os.path.join(os.path.dirname(primary), 'replica.db')
+    shutil.copy(primary, replica_path)
+
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS',
+                        {'replica0': 'sqlite:///' + replica_path})
+    monkeypatch.setitem(app.config, 'DATABASE_REPLICA_BINDS', ['replica0'])
+    routing.recent_writers.clear()
+
+    yield ({'Authorization': 'Bearer ' + writer},
+           {'Authorization': 'Bearer ' + reader})
+
+    routing.recent_writers.clear()
+
+    with app.app_context():
+        db.get_engine(app, bind='replica0').dispose()
+
+    app.extensions['sqlalchemy'].connectors.pop('replica0', None)
+    os.remove(replica_path)
+
+
+def get_instrument_name(client, headers):
+    response = client.get(INSTRUMENT_URL, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()['data']['name']
+
+
+def test_writer_reads_own_write(client, replica):
+    writer, reader = replica
+    original_name = get_instrument_name(client, reader)
+
+    response = client.put(INSTRUMENT_URL, headers=writer,
+                          json={'name': 'Renamed Harp'})
+    assert response.status_code == 200
+
+    assert get_instrument_name(client, writer) == 'Renamed Harp'
+    # Other clients may read the replica, which hasn't seen the change
+    assert get_instrument_name(client, reader) == original_name
+
+
+def test_writer_reads_replica_after_lag(app, client, replica, monkeypatch):
+    writer, reader = replica
+    original_name = get_instrument_name(client, reader)
+
+    monkeypatch.setitem(app.config, 'DATABASE_REPLICA_LAG', 1)
+    response = client.put(INSTRUMENT_URL, headers=writer,
+                          json={'name': 'Lagging Harp'})
+    assert response.status_code == 200
+    assert get_instrument_name(client, writer) == 'Lagging Harp'
+
+    routing.recent_writers.clear()  # As if the lag time had passed
+    assert get_instrument_name(client, writer) == original_name
+
+
+def test_new_api_key_works_before_replica_has_it(app, client, replica):
+    with app.app_context():
+        token = create_api_key(1, 'newer than replica')[1]
+
+    # API keys are looked up on the primary
+    response = client.get(INSTRUMENT_URL,
+                          headers={'Authorization': 'Bearer ' + token})
+    assert response.status_code == 200
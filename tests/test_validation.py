@@ -0,0 +1,72 @@
+"""
+Checks image URL checks against a local server standing in for hosts.
+"""
+import socket
+import time
+from instrument_catalog import validation
+from instrument_catalog.validation import (check_image_url, check_image_urls,
+                                           image_check_is_cached)
+
+
+def test_image_check_is_cached(image_server):
+    url = image_server.url + '/image.png'
+
+    assert not image_check_is_cached(url)
+    assert check_image_url(url) == (url, None)
+    assert image_check_is_cached(url)
+    assert check_image_url(url) == (url, None)
+    assert image_server.paths == ['/image.png']
+
+
+def test_failed_image_check_is_cached(image_server):
+    url = image_server.url + '/missing.png'
+
+    _, error = check_image_url(url)
+    assert 'status code 404' in error
+    assert check_image_url(url) == (url, error)
+    assert image_server.paths == ['/missing.png']
+
+
+def test_unreachable_image_host_is_not_cached(image_server):
+    # Nothing listens on a port which was just closed
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    url = 'http://127.0.0.1:{}/image.png'.format(port)
+    _, error = check_image_url(url)
+
+    assert 'could not be reached' in error
+    assert not image_check_is_cached(url)
+
+
+def test_image_check_times_out(image_server, monkeypatch):
+    monkeypatch.setattr(validation, 'IMAGE_CHECK_TIMEOUT', 0.1)
+    url = image_server.url + '/slow.png'
+
+    start = time.monotonic()
+    _, error = check_image_url(url)
+    assert time.monotonic() - start < image_server.delay
+    assert 'could not be reached' in error
+
+    # The host may only have been busy, so it's asked again next time
+    assert not image_check_is_cached(url)
+    check_image_url(url)
+    assert image_server.paths == ['/slow.png', '/slow.png']
+
+
+def test_image_urls_are_checked_concurrently(image_server):
+    image_server.delay = 0.3
+    urls = ['{}/slow{}.png'.format(image_server.url, number)
+            for number in range(validation.MAX_IMAGE_CHECK_THREADS)]
+
+    start = time.monotonic()
+    # Duplicates and extra spaces are only checked once
+    check_image_urls(urls + [' ' + url + ' ' for url in urls])
+    elapsed = time.monotonic() - start
+
+    assert elapsed < image_server.delay * len(urls) / 2
+    assert image_server.max_active > 1
+    assert sorted(image_server.paths) == sorted(
+        url[len(image_server.url):] for url in urls)
+    assert all(image_check_is_cached(url) for url in urls)